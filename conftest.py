@@ -0,0 +1,72 @@
+import re
+import zipfile
+from io import BytesIO
+
+import pytest
+
+# A flat ODF document with a page layout in inches and the styles used by the tests:
+# Standard (10.5pt paragraph), Break (paragraph on a new page), Bold and Big (14pt) text
+flat_document = """<?xml version="1.0" encoding="UTF-8"?>
+<office:document xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"
+    xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0"
+    xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"
+    xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0">
+<office:styles>
+<style:style style:name="Standard" style:family="paragraph">
+<style:text-properties style:font-name="EpsonRomanProportional" fo:font-size="10.5pt"/>
+</style:style>
+%(styles)s
+</office:styles>
+<office:automatic-styles>
+<style:style style:name="Break" style:family="paragraph" style:parent-style-name="Standard">
+<style:paragraph-properties fo:break-before="page"/>
+</style:style>
+<style:style style:name="Bold" style:family="text"><style:text-properties fo:font-weight="bold"/></style:style>
+<style:style style:name="Big" style:family="text"><style:text-properties fo:font-size="14pt"/></style:style>
+<style:page-layout style:name="pm1">
+<style:page-layout-properties fo:page-width="8.5in" fo:page-height="11in" fo:margin-top="0.5in" fo:margin-bottom="0.5in" fo:margin-left="0.5in" fo:margin-right="0.5in"/>
+</style:page-layout>
+</office:automatic-styles>
+<office:master-styles><style:master-page style:name="Standard" style:page-layout-name="pm1"/></office:master-styles>
+<office:body><office:text>
+%(body)s
+</office:text></office:body>
+</office:document>
+"""
+
+# returns a paragraph element, the first paragraph of each page uses the Break style
+def paragraph(text, style="Standard"):
+    return '<text:p text:style-name="%s">%s</text:p>' % (style, text)
+
+# writes a flat ODF document with the given body and extra styles, returns its path
+@pytest.fixture
+def make_document(tmp_path):
+    def make(body, name="document.fodt", styles=""):
+        path = tmp_path / name
+        path.write_text(flat_document % {'body': body, 'styles': styles}, encoding='utf-8')
+        return str(path)
+    return make
+
+# returns the body of a document with the given number of pages and paragraphs per page
+def pages_body(pages, paragraphs=3, name="Page"):
+    body = []
+    for page in range(1, pages + 1):
+        for i in range(paragraphs):
+            style = "Break" if i == 0 and page > 1 else "Standard"
+            body.append(paragraph("%s %d paragraph %d" % (name, page, i + 1), style))
+    return "\n".join(body)
+
+# returns a zipped ODT file with the content of a flat document
+def zipped_document(flat):
+    header = flat[:flat.index("<office:styles>")]
+    section = lambda name: re.search(r"<office:%s>.*</office:%s>" % (name, name), flat, re.S).group(0)
+    content = header.replace("<office:document ", "<office:document-content ") + \
+        section("automatic-styles") + section("body") + "</office:document-content>"
+    styles = header.replace("<office:document ", "<office:document-styles ") + \
+        section("styles") + section("automatic-styles") + section("master-styles") + "</office:document-styles>"
+    stream = BytesIO()
+    with zipfile.ZipFile(stream, "w") as z:
+        z.writestr("mimetype", "application/vnd.oasis.opendocument.text")
+        z.writestr("content.xml", content)
+        z.writestr("styles.xml", styles)
+    return stream.getvalue()
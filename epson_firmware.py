@@ -5,6 +5,18 @@ scalable_fonts = [0, 1, 10, 11]
 # all fonts work in proportional mode, but not all look right
 proportional_fonts = [0, 1, 9, 10, 11]
 
+# mapping from print quality to the parameter of ESC x
+# draft mode prints faster, but only with fixed pitch and at 10.5pt
+print_qualities = {
+    'draft': 0,
+    'lq': 1,
+}
+draft_pitch = 10
+
+# width of every printable character in 1/360 inch when printing with a fixed pitch in characters per inch
+def fixed_character_width(pitch):
+    return 360 / pitch
+
 # mapping from character table name to
 # - python encoding name
 # - supported font codes
@@ -16,6 +28,9 @@ character_tables = {
     'PC1251': ('windows-1251', [0,1,2,3,4]),
 }
 
+# character tables that are tried for characters missing in the selected table
+fallback_character_tables = ['PC1250', 'PC437', 'PC869']
+
 _font_name_to_code = {
     'EpsonRomanProportional': 0,
     'EpsonSansSerifProportional': 1,
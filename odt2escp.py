@@ -1,7 +1,19 @@
 from epson_firmware import *
-from parse_odt import ODT, Paragraph
+from parse_odt import ODT, Paragraph, PageLocator, to_ns
+from tcp_output import TcpOutput
+from user_characters import UserCharacterCache, glyphs, glyph_width, download_command
 import os
+import sys
 import argparse
+import csv
+import json
+import re
+from queue import Queue, Empty
+from collections import OrderedDict
+from threading import Thread, Lock
+from io import BytesIO
+from bisect import bisect_right
+from itertools import accumulate
 
 # Represents a word and its spacing information
 class Word:
@@ -29,8 +41,49 @@ class Word:
     def __repr__(self):
         return str(self.text)
 
+# a word ends after a hyphen, soft hyphen or dash, spaces and tabs are words of their own
+word_breaks = "\t -\xad–—"
+word_boundaries = re.compile("[\t ]|[^\t \\-\xad–—]*[\\-\xad–—]|[^\t \\-\xad–—]+")
+
+# least recently used cache of laid out paragraphs, can be shared between threads
+class LayoutCache:
+    def __init__(self, size=256):
+        self.size = size
+        self.layouts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            layout = self.layouts.get(key)
+            if layout is None:
+                self.misses += 1
+            else:
+                self.layouts.move_to_end(key)
+                self.hits += 1
+            return layout
+
+    def put(self, key, layout):
+        with self.lock:
+            self.layouts[key] = layout
+            if len(self.layouts) > self.size:
+                self.layouts.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+# largest relative vertical move of one ESC ( v command in 1/360 inch
+max_vertical_move = 32767
+
+# user-defined characters are only used for unscaled proportional text in letter quality
+def user_characters_allowed(quality, font_name, font_size, position):
+    return quality == "lq" and font_size == 10.5 and not position and \
+        font_name_to_code(font_name) in proportional_fonts
+
 class PrinterOutput:
-    def __init__(self, file, page_width=8.5, page_height=11, page_usage=None, margin_top=.5, margin_bottom=.5, margin_right=.5, margin_left=.5, character_table="PC1250"):
+    def __init__(self, file, page_width=8.5, page_height=11, page_usage=None, margin_top=.5, margin_bottom=.5, margin_right=.5, margin_left=.5, character_table="PC1250", quality="lq", layout_cache=None):
         self.outfile = file
         self.line = [] # the current line
         self.word = Word(bytearray()) # the current word
@@ -50,28 +103,90 @@ class PrinterOutput:
         self.default_tab_spacing = 12.5/25.4
         self.font_size = 10.5
         self.character_table = None
+        self.pages_printed = 0
+        self.quality = None
+        self.text_pitch = None # pitch of the text being laid out, None means proportional
+        self.font_scale_factor = 1
+        self.character_widths = {} # text pitch -> character -> width in 1/360 inch
+        self.pending_motion = 0 # vertical motion in 1/360 inch that has not been sent yet
+        self.user_characters = UserCharacterCache()
+        self.layout_cache = LayoutCache() if layout_cache is None else layout_cache
+        self.captured_lines = None # lines of the paragraph that is being laid out for the cache
+        self.allow_user_characters = False
+        self.run_commands = b"" # font settings of the run that is being laid out
 
         self.esc('@')
         self.set_line_spacing(30)
         self.load_character_table(character_table)
         self.esc('t', 1) # select table 1
         self.set_font(font_name_to_code("Roman"))
-        self.esc('p', 1) # proportional mode
-        self.pitch = None # None means proportional pitch
-        self.esc('x', 1) # letter quality
+        self.set_quality(quality)
         self.set_page_margins(1)
 
+    # selects draft or letter quality, changes take effect with the next word
+    def set_quality(self, quality):
+        if quality == self.quality: return
+        assert quality in print_qualities, "Unsupported print quality " + str(quality)
+        cmd = bytearray()
+        if quality == "draft":
+            cmd += self.esc('p', 0, no_write=True) # no proportional mode in draft
+            cmd += self.esc('P', no_write=True) # 10 cpi
+            self.pitch = draft_pitch
+        else:
+            cmd += self.esc('p', 1, no_write=True) # proportional mode
+            self.pitch = None # None means proportional pitch
+        cmd += self.esc('x', print_qualities[quality], no_write=True)
+        if self.quality is None:
+            self.write(cmd)
+        else:
+            self.word.text += cmd
+        self.quality = quality
+
     def set_page_margins(self, page_number):
         margin_left = self.margin_left
         if self.page_usage and self.page_usage == "mirrored" and page_number % 2:
             margin_left = self.margin_right
         if margin_left == self.last_margin_left:
             return
+        self.write(self.margin_commands(margin_left))
+        self.last_margin_left = margin_left
+
+    def margin_commands(self, margin_left):
         top = int((self.margin_top-0.1)*360)
         bottom = int((self.page_height - self.margin_bottom + 0.2) * 360)
-        self.esc('(c', 4,0, top & 0xff, (top >> 8) & 0xff, bottom & 0xff, (bottom >> 8) & 0xff) # set page length
-        self.esc('l', int(margin_left * 10 - 1)) # set left margin
-        self.last_margin_left = margin_left
+        cmd = self.esc('(c', 4,0, top & 0xff, (top >> 8) & 0xff, bottom & 0xff, (bottom >> 8) & 0xff, no_write=True) # set page length
+        cmd += self.esc('l', int(margin_left * 10 - 1), no_write=True) # set left margin
+        return cmd
+
+    # returns a function that returns the commands which bring a printer that was reset into the current state
+    # outputs call it at page boundaries when the connection to a network printer has to be reopened
+    def restore_point(self):
+        state = (self.line_spacing, self.character_table, self.font_code, self.quality, self.last_margin_left,
+            tuple(self.user_characters.slots.items()), bytes(self.run_commands))
+        return lambda: self.restore_commands(*state)
+
+    def restore_commands(self, line_spacing, character_table, font_code, quality, margin_left, user_characters, run_commands):
+        cmd = self.esc('@', no_write=True)
+        if line_spacing == 30:
+            cmd += self.esc('2', no_write=True)
+        else:
+            cmd += self.esc('3', line_spacing, no_write=True)
+        cmd += self.load_character_table(character_table, no_write=True)
+        cmd += self.esc('t', 1, no_write=True)
+        cmd += self.esc('k', font_code, no_write=True)
+        if quality == "draft":
+            cmd += self.esc('p', 0, no_write=True) + self.esc('P', no_write=True)
+        else:
+            cmd += self.esc('p', 1, no_write=True)
+        cmd += self.esc('x', print_qualities[quality], no_write=True)
+        if margin_left is not None:
+            cmd += self.margin_commands(margin_left)
+        # user-defined characters are lost with the reset
+        for char, code in user_characters:
+            cmd += download_command(char, code)
+        # font settings of the run that is being printed
+        cmd += run_commands
+        return cmd
 
     def load_character_table(self, table_name, no_write = None):
         if not no_write and self.character_table == table_name: return
@@ -111,8 +226,7 @@ class PrinterOutput:
         self.line_spacing = spacing
 
     def write(self, data):
-        n = os.write(self.outfile, data)
-        assert n == len(data)
+        self.outfile.write(data)
 
     def esc(self, *args, no_write = None):
         cmd = bytearray()
@@ -139,8 +253,8 @@ class PrinterOutput:
         else:
             return cmd
 
-    def set_relative_vertical_position(self, pos, no_write=None):
-        pos = int(pos*360)
+    def set_relative_vertical_position(self, pos, no_write=None, units=None):
+        pos = int(pos*360) if units is None else units
         cmd = bytearray()
         cmd.append(0x1b)
         cmd += b'(v\x02\x00'
@@ -209,25 +323,54 @@ class PrinterOutput:
                 start_x += w.size
         return result
 
+    # vertical moves are collected and sent before the next printed line
+    def move_down(self, distance):
+        self.pending_motion += int(distance*360)
+
     def process_line(self, last_line = None):
-        self.line = self.join_words(self.line, last_line)
-        if self.line_height == 0:
+        blank = not self.line
+        line = self.join_words(self.line, last_line)
+        # draft prints every size in the default 10.5pt font
+        if self.line_height == 0 or self.quality == "draft":
             self.line_height = 10.5
         new_line_spacing = int(self.line_height/72*180*1.15*self.paragraph.line_height_factor)
-        if new_line_spacing != self.line_spacing:
-            self.set_line_spacing(new_line_spacing)
-        self.write(b"\r\n")
-        self.write(self.line)
+        self.emit_line(line, blank, new_line_spacing)
         self.line = []
         self.line_size = 0
         self.line_height = 0
         self.allow_leading_whitespace = False
         self.allow_line_indent = False
 
+    # sends a laid out line
+    def emit_line(self, line, blank, line_spacing):
+        if self.captured_lines is not None:
+            self.captured_lines.append((line, blank, line_spacing))
+        if blank:
+            # blank lines only advance the paper
+            self.pending_motion += line_spacing * 2
+            return
+        if self.pending_motion:
+            # the move is sent on its own, the printer ignores a move that leaves the printable area
+            # but the line feed still advances the paper
+            self.move_paper(self.pending_motion)
+            self.pending_motion = 0
+        if line_spacing != self.line_spacing:
+            self.set_line_spacing(line_spacing)
+        self.write(b"\r\n")
+        self.write(line)
+        self.user_characters.printed(line)
+
+    # sends a vertical move in 1/360 inch, split into moves that fit the signed 16 bit parameter of ESC ( v
+    def move_paper(self, units):
+        while units:
+            step = max(-max_vertical_move, min(units, max_vertical_move))
+            self.set_relative_vertical_position(None, units=step)
+            units -= step
+
     def new_paragraph(self, paragraph):
         self.paragraph = paragraph
         if self.paragraph.margin_top:
-            self.set_relative_vertical_position(self.paragraph.margin_top)
+            self.move_down(self.paragraph.margin_top)
         self.allow_leading_whitespace = True
         self.allow_line_indent = True
 
@@ -240,7 +383,55 @@ class PrinterOutput:
         self.add_word()
         self.process_line(last_line = True)
         if self.paragraph.margin_bottom:
-            self.set_relative_vertical_position(self.paragraph.margin_bottom)
+            self.move_down(self.paragraph.margin_bottom)
+
+    # returns everything that determines the layout of the runs of the current paragraph
+    def layout_key(self, runs):
+        p = self.paragraph
+        return (tuple((tuple(font_style), text) for font_style, text in runs),
+            p.alignment, p.margin_left, p.margin_right, p.text_indent, p.line_height_factor, self.max_text_width,
+            self.allow_leading_whitespace, self.allow_line_indent,
+            bytes(self.word.text), self.word.height, self.font_code, self.character_table, self.quality)
+
+    # prints a paragraph without page breaks, runs are (font parameters, text) pairs
+    # identical paragraphs are replayed from the layout cache
+    def print_paragraph(self, runs):
+        if self.line or self.word.size:
+            key = None
+        else:
+            key = self.layout_key(runs)
+        layout = self.layout_cache.get(key) if key else None
+        # replayed lines may only refer to downloaded characters that are still in place
+        if layout and all(self.user_characters.code_of(c) == code for c, code in layout[4].items()):
+            lines, word_text, word_height, font_code, glyph_codes = layout
+            for line in lines:
+                self.emit_line(*line)
+            # the rest of the paragraph is printed with the next line
+            self.user_characters.expect(word_text)
+            self.word = Word(bytearray(word_text), height=word_height)
+            self.font_code = font_code
+            self.allow_leading_whitespace = False
+            self.allow_line_indent = False
+        else:
+            downloads = self.user_characters.downloads
+            self.user_characters.referenced = {}
+            self.captured_lines = []
+            for font_style, text in runs:
+                if text == "\r\n":
+                    self.paragraph_break()
+                else:
+                    self.add_text(text, *font_style)
+            self.add_word()
+            self.process_line(last_line = True)
+            lines = self.captured_lines
+            glyph_codes = self.user_characters.referenced
+            self.captured_lines = None
+            self.user_characters.referenced = None
+            # lines with character downloads are not cached, the next occurrence will be
+            if key and downloads == self.user_characters.downloads:
+                self.layout_cache.put(key, (lines, bytes(self.word.text), self.word.height, self.font_code, glyph_codes))
+        if self.paragraph.margin_bottom:
+            self.move_down(self.paragraph.margin_bottom)
 
     def new_page(self, page_number):
         self.add_word()
@@ -248,19 +439,23 @@ class PrinterOutput:
             self.process_line()
         self.write(b"\r")
         self.write(b"\f") # form feed
+        self.pending_motion = 0 # motion at the end of a page is not needed
+        self.pages_printed += 1
+        self.outfile.page_boundary(self.restore_point())
         if self.page_usage == "mirrored":
             self.set_page_margins(page_number)
 
     def end(self):
         self.new_page(0)
         self.esc('@')
+        self.outfile.flush()
 
     def add_word(self):
         if self.word.size:
             if self.line and self.line[-1].is_soft_hyphen():
                 # remove unused soft hyphen
                 self.line[-1].text = self.line[-1].text[:-1]
-                soft_hyphen_size = 30/360 * self.font_scale_factor
+                soft_hyphen_size = self.get_character_width('\xad')/360 * self.font_scale_factor
                 self.line[-1].size -= soft_hyphen_size
                 self.line_size -= soft_hyphen_size
             self.line.append(self.word)
@@ -271,41 +466,76 @@ class PrinterOutput:
     def get_character_width(self, c):
         if c == 9:
             return 30
-        return proportional_character_width.get(c)
+        width = proportional_character_width.get(c)
+        if width is None and c in glyphs:
+            width = glyph_width(c)
+        if width and self.text_pitch:
+            return fixed_character_width(self.text_pitch)
+        return width
 
     # split text into words and encode them according to the selected character table
     def text_to_words(self, text, height, encoding):
         words = []
-        i = 0
-        while i < len(text):
-            c = ord(text[i])
-            if c == 9 or c == 32:
-                if i > 0:
-                    words.append(Word(text[0:i], height=height, may_break = True))
-                words.append(Word(text[i:i+1], height=height, may_break = True))
-                text = text[i+1:]
-                i = 0
-            # hyphen, soft hyphen and dash
-            elif c in [ord('-'), 0xad, ord('–'), ord('—')]:
-                words.append(Word(text[0:i+1], height=height, may_break = True))
-                text = text[i+1:]
-                i = 0
-            else:
-                i += 1
-        if len(text):
-            words.append(Word(text, height=height))
+        pieces = word_boundaries.findall(text)
+        widths = self.character_widths.setdefault(self.text_pitch, {})
+        for c in set(text).difference(widths):
+            widths[c] = self.get_character_width(c)
+            assert not widths[c] is None, "Undefined character code %s (%x, %s)" % (c, ord(c), text[:10])
+        for i, piece in enumerate(pieces):
+            # a break is allowed after spaces, tabs, dashes and before spaces and tabs
+            may_break = True if piece[-1] in word_breaks or i + 1 < len(pieces) else None
+            word = Word(piece, height=height, may_break=may_break)
+            word.size = sum(map(widths.__getitem__, piece)) / 360 * self.font_scale_factor
+            words.append(word)
 
-        # calculate size
+        # all supported character tables have one byte per character, so words can be cut from the encoded run
+        try:
+            encoded = text.encode(encoding)
+        except UnicodeEncodeError:
+            encoded = None
+        start = 0
         for word in words:
-            word.size = 0
-            for c in word.text:
-                size = self.get_character_width(c)
-                assert not size is None, "Undefined character code %s (%x, %s)" % (c, ord(c), word.text[:10])
-                word.size += size
-            word.size = word.size / 360 * self.font_scale_factor
-            word.text = word.text.encode(encoding)
+            end = start + len(word.text)
+            word.text = encoded[start:end] if encoded is not None else self.encode_text(word.text, encoding)
+            start = end
         return words
 
+    # encodes text with the given encoding, characters that are not part of it are printed as user-defined characters
+    def encode_text(self, text, encoding):
+        try:
+            return text.encode(encoding)
+        except UnicodeEncodeError:
+            if not self.allow_user_characters:
+                raise
+        result = bytearray()
+        for c in text:
+            try:
+                result += c.encode(encoding)
+            except UnicodeEncodeError:
+                result += self.user_characters.reference(c)
+        return result
+
+    # returns the index of the first character that can neither be encoded nor downloaded, or None
+    def find_unencodable(self, text, encoding):
+        try:
+            text.encode(encoding)
+            return None
+        except UnicodeEncodeError as error:
+            if not self.allow_user_characters:
+                return error.start
+            for i in range(error.start, len(text)):
+                if text[i] in glyphs:
+                    continue
+                try:
+                    text[i].encode(encoding)
+                except UnicodeEncodeError:
+                    return i
+            return None
+
+    # user-defined characters are only used for unscaled proportional text in letter quality
+    def can_use_user_characters(self, font_name, font_size, position):
+        return user_characters_allowed(self.quality, font_name, font_size, position)
+
     def get_tab_size(self):
         abs_pos = self.paragraph.margin_right + self.line_size
         res = self.next_tab(abs_pos) - abs_pos
@@ -315,34 +545,142 @@ class PrinterOutput:
     def add_text(self, text, font_name, font_size, weight, style, underline, position):
         character_table = self.character_table
         encoding = character_tables[character_table][0]
-        try_character_tables = ['PC1250', 'PC437', 'PC869']
+        self.allow_user_characters = self.can_use_user_characters(font_name, font_size, position)
         while 1:
-            try:
-                text.encode(encoding)
+            start = self.find_unencodable(text, encoding)
+            if start is None:
                 break
-            except UnicodeEncodeError as error:
-                if error.start:
-                    self.break_text(text[:error.start], font_name, font_size, weight, style, underline, position, character_table)
-                text = text[error.start:]
-                char = text[0]
-                for character_table in try_character_tables:
-                    try:
-                        encoding = character_tables[character_table][0]
-                        char.encode(encoding)
-                        break
-                    except:
-                        continue
-                else:
-                    raise Exception("The character %s cannot be encoded" % char)
-                continue
+            if start:
+                self.break_text(text[:start], font_name, font_size, weight, style, underline, position, character_table)
+            text = text[start:]
+            char = text[0]
+            for character_table in fallback_character_tables:
+                try:
+                    encoding = character_tables[character_table][0]
+                    char.encode(encoding)
+                    break
+                except:
+                    continue
+            else:
+                raise Exception("The character %s cannot be encoded" % char)
 
         if len(text):
             self.break_text(text, font_name, font_size, weight, style, underline, position, character_table)
 
+    # adds words to lines, breaking lines where the next word does not fit
+    # widths are summed up front, words that certainly fit are found by bisection and added without checks
+    def break_words(self, words):
+        ends = [0] # total width up to the end of each word, tabs are measured when they are reached
+        for w in words:
+            ends.append(ends[-1] + (0 if w.text == b"\t" else w.size))
+        tabs = [i for i, w in enumerate(words) if w.text == b"\t"] + [len(words)]
+        # there's some added allowance for rounding errors in the font used
+        limit = self.get_max_paragraph_width() + 5/360
+        i = 0
+        next_tab = 0
+        while i < len(words):
+            if tabs[next_tab] < i:
+                next_tab += 1
+            stop = tabs[next_tab]
+            if i < stop:
+                # the width of the line can only shrink by dropping soft hyphens, so the sum is an upper bound
+                room = limit - self.line_size - self.word.size + ends[i] - 1e-9
+                checked = bisect_right(ends, room, i + 1, stop + 1) - 1
+                self.add_fitting_words(words[i:checked])
+                i = checked
+                if i == stop:
+                    continue
+            if self.add_to_line(words[i], limit):
+                limit = self.get_max_paragraph_width() + 5/360
+            i += 1
+
+    # adds words without tabs that are known to fit on the line, same as add_to_line without the checks
+    # words are moved to the line instead of being copied into the current word
+    def add_fitting_words(self, words):
+        line = self.line
+        word = self.word # None after it was added to the line
+        line_size = self.line_size
+        line_height = self.line_height
+        soft_hyphen_size = self.get_character_width('\xad')/360 * self.font_scale_factor
+        for w in words:
+            space = w.text == b" "
+            if word is not None and (space or word.may_break) and word.size:
+                # same as add_word
+                last = line[-1] if line else None
+                if last and last.text and last.text[-1] == 0xad:
+                    # remove unused soft hyphen
+                    last.text = last.text[:-1]
+                    last.size -= soft_hyphen_size
+                    line_size -= soft_hyphen_size
+                line.append(word)
+                line_height = max(line_height, word.height)
+                line_size += word.size
+                word = None
+            if word is None:
+                if space:
+                    w.height = 0 # spaces don't contribute to the line height
+                word = w
+            elif space:
+                # the space is added to the line with the next word
+                word.text += w.text
+                word.size += w.size
+                word.may_break = True
+            else:
+                word.append(w)
+        self.word = Word(bytearray()) if word is None else word
+        self.line_size = line_size
+        self.line_height = line_height
+        if words and words[-1].is_space():
+            self.add_word()
+        elif type(self.word.text) != bytearray:
+            self.word.text = bytearray(self.word.text)
+
+    # adds a word to the line, the line is broken before it if it exceeds the limit
+    # returns True if a line was broken
+    def add_to_line(self, w, limit=None):
+        if w.is_space() or w.is_tab():
+            self.add_word()
+        if w.is_space():
+            # always add spaces - they will be ignored later
+            self.word.text += w.text
+            self.word.size += w.size
+            self.add_word()
+            return False
+        if w.is_tab(): w.size = self.get_tab_size()
+        broken = False
+        # the condition which determines when to break a line
+        if limit is not None and self.line_size and self.line_size + self.word.size + w.size > limit:
+            broken = True
+            # some rules for line breaks
+            # don't break between tab and word
+            if self.line[-1].is_tab() and not (self.word.is_tab() or self.word.is_space()):
+                tab = self.line.pop()
+                self.line_size -= tab.size
+                self.process_line()
+                tab.size = self.get_tab_size()
+                self.line.append(tab)
+                self.line_size += tab.size
+                self.line_height = tab.height
+            else:
+                # don't break ongoing word without space
+                if self.word.may_break:
+                    self.add_word()
+                self.process_line()
+            if w.is_tab(): w.size = self.get_tab_size()
+        if self.word.may_break:
+            self.add_word()
+        self.word.append(w)
+        return broken
+
     def break_text(self, text, font_name, font_size, weight, style, underline, position, character_table):
         encoding = character_tables[character_table][0]
-        self.font_scale_factor = font_size / 10.5
-        self.whitespace_width = proportional_character_width.get(' ') / 360 * self.font_scale_factor
+        font_code = font_name_to_code(font_name)
+        if font_code in proportional_fonts and self.quality != "draft": pitch = None
+        else: pitch = self.pitch or 10
+        self.text_pitch = pitch
+        # fixed pitch text is not scaled
+        self.font_scale_factor = font_size / 10.5 if pitch is None else 1
+        self.whitespace_width = self.get_character_width(' ') / 360 * self.font_scale_factor
 
         # preserve leading whitespace of the first line in a paragraph
         if self.allow_leading_whitespace and len(self.line) == 0:
@@ -360,74 +698,40 @@ class PrinterOutput:
 
         # apply font settings
         self.word.height = max(self.word.height, font_size)
-        font_code = font_name_to_code(font_name)
-        if font_code in proportional_fonts: pitch = None
-        else: pitch = 10
 
+        cmd = bytearray()
         if not font_code in character_tables[character_table][1]:
-            print("Falling back to PC437")
-            self.word.text += self.load_character_table('PC437', no_write = True)
+            print("Falling back to PC437", file=sys.stderr)
+            cmd += self.load_character_table('PC437', no_write = True)
         elif self.character_table != character_table:
-            self.word.text += self.load_character_table(character_table, no_write = True)
+            cmd += self.load_character_table(character_table, no_write = True)
         if font_size != self.font_size or pitch != self.pitch:
-            if font_code in proportional_fonts:
-                self.word.text += b"\x1bX\x01"
-                self.word.text.append(int(font_size*2))
-                self.word.text.append(0)
-            else:
-                self.word.text += b"\x1bp\x00" # turn off proportional mode
-                self.word.text += b"\x1bP" # cancel multipoint, select 10 cpi
+            if pitch is None:
+                cmd += b"\x1bX\x01"
+                cmd.append(int(font_size*2))
+                cmd.append(0)
+            elif pitch != self.pitch:
+                cmd += b"\x1bp\x00" # turn off proportional mode
+                cmd += b"\x1bP" # cancel multipoint, select 10 cpi
         if style == "italic":
-            self.word.text += b"\x1b4"
+            cmd += b"\x1b4"
         if weight == "bold":
-            self.word.text += b"\x1bE"
+            cmd += b"\x1bE"
         if underline == "solid":
-            self.word.text += b"\x1b-\x01"
+            cmd += b"\x1b-\x01"
         previous_font = None
         if font_code != self.font_code:
             previous_font = self.font_code
-            self.word.text += self.set_font(font_code, no_write=True)
+            cmd += self.set_font(font_code, no_write=True)
         if position:
             if position.startswith("super"):
-                self.word.text += b"\x1bS\x00"
+                cmd += b"\x1bS\x00"
             elif position.startswith("sub"):
-                self.word.text += b"\x1bS\x01"
+                cmd += b"\x1bS\x01"
+        self.word.text += cmd
+        self.run_commands = cmd
 
-        # determine line breaks
-        for i, w in enumerate(words):
-            if w.is_space() or w.is_tab():
-                self.add_word()
-            if w.is_space():
-                # always add spaces - they will be ignored later
-                self.word.text += w.text
-                self.word.size += w.size
-                self.add_word()
-                continue
-            if w.is_tab(): w.size = self.get_tab_size()
-            new_end = self.line_size + self.word.size + w.size
-            # the condition which determines when to break a line
-            # there's some added allowance for rounding errors in the font used
-            if self.line_size and new_end > self.get_max_paragraph_width() + 5/360:
-                # some rules for line breaks
-                # don't break between tab and word
-                if self.line[-1].is_tab() and not (self.word.is_tab() or self.word.is_space()):
-                    tab = self.line[-1]
-                    self.line_size -= tab.size
-                    self.line = self.line[:-1]
-                    self.process_line()
-                    tab.size = self.get_tab_size()
-                    self.line.append(tab)
-                    self.line_size += tab.size
-                    self.line_height = tab.height
-                else:
-                    # don't break ongoing word without space
-                    if self.word.may_break:
-                        self.add_word()
-                    self.process_line()
-                if w.is_tab(): w.size = self.get_tab_size()
-            if self.word.may_break:
-                self.add_word()
-            self.word.append(w)
+        self.break_words(words)
 
         if self.word.is_tab(): 
             self.add_word()
@@ -435,7 +739,9 @@ class PrinterOutput:
         # reset font to default
         if self.character_table != character_table:
             self.word.text += self.load_character_table(self.character_table, no_write = True)
-        if font_size != 10.5:
+        if pitch != self.pitch:
+            self.word.text += b"\x1bp\x01" # back to proportional mode
+        if font_size != 10.5 and self.quality != "draft":
             self.word.text += b"\x1bX\x00\x15\x00"
         if style == "italic":
             self.word.text += b"\x1b5"
@@ -447,9 +753,10 @@ class PrinterOutput:
             self.word.text += self.set_font(previous_font, no_write=True)
         if position:
             self.word.text += b"\x1bT"
+        self.run_commands = b""
 
-def print_font_test_page(f):
-    printer = PrinterOutput(f)
+def print_font_test_page(f, quality="lq"):
+    printer = PrinterOutput(f, quality=quality)
     fonts = [
         'Roman',
         'SansSerif',
@@ -471,70 +778,521 @@ def print_font_test_page(f):
             printer.add_text("c=%d %.1fpt - The quick brown fox jumps over the lazy dog" % (code, size), font_name, size, None, None, None, None)
             printer.end_paragraph()
     printer.end()
+    return printer.pages_printed
 
 def get_style_params(style):
     font_name = style.get('font-name', 'EpsonRomanProportional')
     font_size = style.get('font-size', '12pt')
     if font_size:
-        assert font_size[-2:] == "pt"
+        assert font_size[-2:] == "pt", "Unsupported font size %s, only points are supported" % font_size
         font_size = float(font_size[:-2])
     font_weight = style.get('font-weight')
     font_style = style.get('font-style')
     underline = style.get('text-underline-style')
     position = style.get('text-position')
     #assert font_name in supported_fonts, 'Unknown font ' + str(font_name)
-    assert font_size in supported_sizes, 'Font size has to be one of ' + str(supported_sizes)
+    assert font_size in supported_sizes, 'Unsupported font size %spt, it has to be one of %s' % (font_size, supported_sizes)
     return font_name, font_size, font_weight, font_style, underline, position
 
-def print_odt(args, f):
-    doc = ODT(args.path)
-    printer = PrinterOutput(f, doc.page_width, doc.page_height, doc.page_usage, doc.margin_top, doc.margin_bottom, doc.margin_left, doc.margin_right, args.character_table)
+# "-" reads the document from stdin
+def open_document(path):
+    return ODT(sys.stdin.buffer if path == "-" else path)
+
+# placeholders for mail merge
+# names are everything between the braces without surrounding whitespace, e.g. {{ First name }}
+field_marker = re.compile(r"\{\{\s*([^{}]+?)\s*\}\}")
+
+# runs that are handled separately by print_odt or the line breaker
+run_boundaries = ["\t", "\r\n", "\f"]
+
+# merges adjacent runs with equal font parameters
+# returns a list of (font parameters, text) pairs
+def coalesce_runs(runs):
+    result = []
+    for style, text in runs:
+        font_style = get_style_params(style)
+        if result and result[-1][0] == font_style and not text in run_boundaries and not result[-1][1] in run_boundaries:
+            result[-1][1] += text
+        else:
+            result.append([font_style, text])
+    return result
+
+# A document prepared for printing. With merge set, the runs of each paragraph are parsed once
+# and user fields or {{name}} markers are replaced by the values of each record.
+class Template:
+    def __init__(self, doc, merge=False):
+        self.doc = doc
+        self.merge = merge
+        self.paragraphs = doc.parse_paragraphs()
+        self.locator = PageLocator(self.paragraphs)
+        self.runs = {} # paragraph index -> (runs, True if the runs contain placeholders)
+
+    def get_runs(self, index, fields=None):
+        if not self.merge:
+            paragraph = self.paragraphs[index]
+            return coalesce_runs(self.doc.parse(paragraph.element, paragraph.style))
+        runs, has_fields = self.compile(index)
+        if not has_fields or fields is None:
+            return runs
+        replace = lambda match: field_text(fields.get(match.group(1)))
+        return [[font_style, field_marker.sub(replace, text)] for font_style, text in runs]
+
+    # returns the runs of a paragraph with placeholders and True if there are any
+    def compile(self, index):
+        compiled = self.runs.get(index)
+        if compiled is None:
+            paragraph = self.paragraphs[index]
+            runs = coalesce_runs(self.doc.parse(paragraph.element, paragraph.style, user_fields=True))
+            compiled = (runs, any(field_marker.search(text) for font_style, text in runs))
+            self.runs[index] = compiled
+        return compiled
+
+# JSON null and missing fields print as nothing
+def field_text(value):
+    return "" if value is None else str(value)
+
+# returns the selected pages, the pages followed by a form feed and the pages printed in draft quality
+def select_pages(args):
+    pages = set(args.pages)
+    # the last selected page is ejected by printer.end()
+    feed_pages = pages - {max(pages)} if pages else pages
+    return pages, feed_pages, set(args.draft_pages)
+
+# raised when documents cannot be printed, problems are "path: problem" lines
+class DocumentProblems(Exception):
+    def __init__(self, problems):
+        super().__init__("Cannot print:\n" + "\n".join(problems))
+        self.problems = problems
+
+# returns a list of problems that would stop printing of the selected pages
+# only styles and runs are checked, no layout is done
+def check_document(doc, args):
+    problems = []
+    for name in ["page_width", "page_height", "margin_top", "margin_bottom", "margin_left", "margin_right"]:
+        value = getattr(doc, name, None)
+        if type(value) != float:
+            problems.append("Page layout: unsupported %s %s" % (name.replace('_', '-'), value))
+    if not args.character_table in character_table_to_code:
+        problems.append("Unsupported character table %s" % args.character_table)
+
+    # paragraph formats are needed to print any page, they are checked for the whole document
+    paragraphs = []
+    paragraph_problems = {} # paragraph index -> problem
+    for index, (element, i) in enumerate(doc.get_paragraph_elements()):
+        style_name = element.attrib.get(to_ns('text:style-name'))
+        # styles are resolved on first use, a missing parent style shows up here
+        try:
+            style = doc.styles[style_name]
+        except KeyError as error:
+            paragraph_problems[index] = "unknown style %s" % error.args[0]
+            style = {}
+        try:
+            paragraph = Paragraph.from_odt_element(element, style, i)
+        except (AssertionError, ValueError) as error:
+            paragraph_problems[index] = str(error)
+            # keep the page break so that the following pages are counted correctly
+            paragraph = Paragraph.from_odt_element(element, {'break-before': style.get('break-before')}, i)
+            paragraph.style = style
+        paragraphs.append(paragraph)
+    locator = PageLocator(paragraphs)
+
+    # problems are reported in document order
+    selection = select_pages(args)
+    pages = selection[0]
+    for index, paragraph in enumerate(paragraphs):
+        location = "Page %d, paragraph %d" % (locator.first_page[index], index + 1)
+        if index in paragraph_problems:
+            problems.append("%s: %s" % (location, paragraph_problems[index]))
+        if not locator.intersects(index, pages):
+            continue
+        missing_styles = []
+        try:
+            runs = doc.parse(paragraph.element, paragraph.style, missing_styles=missing_styles)
+        except (AssertionError, ValueError) as error:
+            problems.append("%s: %s" % (location, error))
+            continue
+        for name in sorted(set(missing_styles)):
+            problems.append("%s: unknown style %s" % (location, name))
+        problems += check_runs(runs, check_run, locator.first_page[index], index + 1, args, selection)
+    return problems
+
+# returns the problems of the placeholders of a mail merge record on the selected pages
+# the rest of the template is checked by check_document
+def check_record(template, fields, args, selection):
+    problems = []
+    pages = selection[0]
+    locator = template.locator
+    for index in locator.paragraph_range(min(pages), max(pages)) if pages else []:
+        if locator.intersects(index, pages) and template.compile(index)[1]:
+            runs = template.get_runs(index, fields)
+            problems += check_runs(runs, check_text, locator.first_page[index], index + 1, args, selection)
+    return problems
 
-    page_number = 1
-    for paragraph in doc.parse_paragraphs():
-        if paragraph.is_break:
+# returns the placeholders of a mail merge template that are split across differently formatted runs
+# they are printed as they are, the formatting has to be the same for the whole marker
+def check_template(template, args):
+    problems = []
+    pages = select_pages(args)[0]
+    locator = template.locator
+    for index in locator.paragraph_range(min(pages), max(pages)) if pages else []:
+        if not locator.intersects(index, pages):
+            continue
+        runs = template.compile(index)[0]
+        boundaries = set(accumulate(len(text) for font_style, text in runs))
+        for match in field_marker.finditer("".join(text for font_style, text in runs)):
+            if any(match.start() < b < match.end() for b in boundaries):
+                problems.append("Page %d, paragraph %d: the placeholder %s changes its formatting, it is not replaced" %
+                    (locator.first_page[index], index + 1, match.group(0)))
+    return problems
+
+# returns the problems of the runs of a paragraph that are on selected pages
+# check is check_run for runs with styles and check_text for runs with font parameters
+def check_runs(runs, check, page_number, paragraph_number, args, selection):
+    pages, feed_pages, draft_pages = selection
+    problems = []
+    for style, text in runs:
+        if text == "\f":
             page_number += 1
-            if page_number-1 in args.pages:
-                printer.new_page(page_number)
+            continue
+        if not page_number in pages:
+            continue
+        for problem in check(style, text, args, page_number in draft_pages):
+            problem = "Page %d, paragraph %d: %s" % (page_number, paragraph_number, problem)
+            if not problem in problems:
+                problems.append(problem)
+    return problems
+
+# returns the problems of a single run
+def check_run(style, text, args, draft):
+    try:
+        font_style = get_style_params(style)
+    except AssertionError as error:
+        return [str(error)]
+    return check_text(font_style, text, args, draft)
+
+# returns the problems of text printed with the given font parameters
+def check_text(font_style, text, args, draft):
+    font_name, font_size, weight, style, underline, position = font_style
+    downloadable = user_characters_allowed("draft" if draft else args.quality, font_name, font_size, position)
+    problems = []
+    for c in sorted(set(text)):
+        if proportional_character_width.get(c) is None and not c in glyphs:
+            problems.append("undefined character %s (%x)" % (c, ord(c)))
+        elif not (downloadable and c in glyphs) and \
+            not any(can_encode(c, table) for table in [args.character_table] + fallback_character_tables):
+            problems.append("the character %s cannot be encoded" % c)
+    return problems
+
+# raises DocumentProblems with all problems before anything is sent to the printer
+def preflight(doc, args, path):
+    problems = check_document(doc, args)
+    if problems:
+        raise DocumentProblems(["%s: %s" % (path, problem) for problem in problems])
 
-        result = doc.parse(paragraph.element, paragraph.style)
+def can_encode(c, character_table):
+    try:
+        c.encode(character_tables[character_table][0])
+        return True
+    except (UnicodeEncodeError, KeyError):
+        return False
 
-        if page_number in args.pages or \
-            (result and result[0][1] == "\f" and page_number + 1 in args.pages):
-            result = doc.parse(paragraph.element, paragraph.style)
+# prints the selected pages of a document, the last page is not ejected
+def print_document(printer, template, args, fields=None, selection=None):
+    pages, feed_pages, draft_pages = selection or select_pages(args)
+    paragraphs = template.paragraphs
+    locator = template.locator
+    selection = locator.paragraph_range(min(pages), max(pages)) if pages else []
+    for index in selection:
+        paragraph = paragraphs[index]
+        page_number = locator.first_page[index]
+        if paragraph.is_break and page_number-1 in feed_pages:
+            printer.new_page(page_number)
+
+        # skip paragraphs on unselected pages without building their runs
+        if not locator.intersects(index, pages):
+            continue
+
+        runs = template.get_runs(index, fields)
+
+        if page_number in pages or \
+            (runs and runs[0][1] == "\f" and page_number + 1 in pages):
             printer.new_paragraph(paragraph)
         else:
             printer.paragraph = paragraph
             printer.allow_leading_whitespace = False
             printer.allow_line_indent = False
 
-        for style, text in result:
-            font_style = get_style_params(style)
+        if page_number in pages and not any(text == "\f" for font_style, text in runs):
+            printer.set_page_margins(page_number)
+            printer.set_quality("draft" if page_number in draft_pages else args.quality)
+            printer.print_paragraph(runs)
+            continue
+
+        for font_style, text in runs:
             if text == "\r\n":
-                if page_number in args.pages:
+                if page_number in pages:
                     printer.paragraph_break()
             elif text == "\f":
                 page_number += 1
-                if page_number-1 in args.pages:
+                if page_number-1 in feed_pages:
                     printer.new_page(page_number)
             else:
-                if page_number in args.pages:
+                if page_number in pages:
                     printer.set_page_margins(page_number)
+                    printer.set_quality("draft" if page_number in draft_pages else args.quality)
                     printer.add_text(text, *font_style)
 
-        if page_number in args.pages:
+        if page_number in pages:
             printer.end_paragraph()
+
+def create_printer(args, f, doc, layout_cache=None):
+    return PrinterOutput(f, doc.page_width, doc.page_height, doc.page_usage, doc.margin_top, doc.margin_bottom, doc.margin_left, doc.margin_right, args.character_table, args.quality, layout_cache)
+
+def print_odt(args, f, doc=None, layout_cache=None):
+    if doc is None:
+        doc = open_document(args.path)
+    if args.preflight:
+        preflight(doc, args, args.path)
+    printer = create_printer(args, f, doc, layout_cache)
+    print_document(printer, Template(doc), args)
     printer.end()
+    return printer.pages_printed
+
+# reads records for mail merge from a CSV file with a header line or from a JSON lines file
+def read_records(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.jsonl') or path.endswith('.json'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+# prints one copy of the template per record into a continuous stream
+# records is shared between devices, each device takes the next (number, fields) pair when it is idle
+# records with problems are skipped and reported at the end
+# returns 0 without touching the device if no record is left
+def print_merge(args, f, template, records, lock, layout_cache=None):
+    selection = select_pages(args)
+    printer = None
+    problems = []
+    while 1:
+        with lock:
+            record = next(records, None)
+        if record is None:
+            break
+        number, fields = record
+        if args.preflight:
+            record_problems = check_record(template, fields, args, selection)
+            if record_problems:
+                problems += ["%s: record %d: %s" % (args.paths[0], number, problem) for problem in record_problems]
+                continue
+        if printer is None:
+            printer = create_printer(args, f, template.doc, layout_cache)
+            # static paragraphs of all records should stay in the cache
+            printer.layout_cache.size = max(printer.layout_cache.size, 2 * len(template.paragraphs))
+        else:
+            printer.new_page(1)
+        print_document(printer, template, args, fields, selection)
+    if printer is not None:
+        printer.end()
+    if problems:
+        raise DocumentProblems(problems)
+    return printer.pages_printed if printer is not None else 0
+
+# writes printer data to a file descriptor, for example of a device, a FIFO or stdout
+class FileOutput:
+    def __init__(self, fd):
+        self.fd = fd
+
+    def write(self, data):
+        n = os.write(self.fd, data)
+        assert n == len(data)
+
+    def page_boundary(self, setup=None):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        os.close(self.fd)
+
+# writes printer data to a binary stream such as io.BytesIO or sys.stdout.buffer
+class StreamOutput:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, data):
+        self.stream.write(data)
+
+    def page_boundary(self, setup=None):
+        pass
+
+    def flush(self):
+        self.stream.flush()
+
+# returns render options with the defaults of the command line
+def render_options(pages=None, character_table="PC1250", quality="lq", draft_pages=(), check=True):
+    return argparse.Namespace(
+        path="document",
+        pages=range(1, 10000) if pages is None else pages,
+        character_table=character_table,
+        quality=quality,
+        draft_pages=list(draft_pages),
+        preflight=check)
+
+# renders a document and writes the ESC/P2 data to a binary stream
+# source is a path, a binary stream or the content of an ODT file
+# options are the keyword arguments of render_options()
+# separate calls share no state except the optional layout cache, so documents can be rendered in parallel threads
+def render_to(stream, source, layout_cache=None, **options):
+    args = render_options(**options)
+    if type(source) == str:
+        args.path = source
+    if type(source) in [bytes, bytearray]:
+        source = BytesIO(source)
+    print_odt(args, StreamOutput(stream), ODT(source), layout_cache)
+
+# renders a document and returns the ESC/P2 data
+def render(source, layout_cache=None, **options):
+    stream = BytesIO()
+    render_to(stream, source, layout_cache, **options)
+    return stream.getvalue()
+
+# parses page ranges like 1-3,7 into a list of page numbers
+def parse_page_ranges(text):
+    pages = []
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        first, _, last = part.partition('-')
+        pages.extend(range(int(first), int(last or first) + 1))
+    return pages
+
+# an output device with its own progress counters
+class Device:
+    def __init__(self, name, timeout=None):
+        self.name = name
+        if name and name.startswith("tcp://"):
+            self.file = TcpOutput.from_url(name, timeout=timeout)
+        elif name:
+            self.file = FileOutput(os.open(name, os.O_WRONLY))
+        else:
+            self.file = FileOutput(1) # stdout handle
+        self.jobs = 0
+        self.pages = 0
+        self.layout_cache = LayoutCache() # shared by all jobs of the device
+
+    def close(self):
+        self.file.close()
+
+# splits pages into at most count contiguous ranges of similar length
+def split_pages(pages, count):
+    pages = sorted(pages)
+    size = max(1, -(-len(pages) // count))
+    return [pages[i:i+size] for i in range(0, len(pages), size)]
+
+# returns the print jobs and whether jobs[i] belongs to device i
+# otherwise there is one job per document, or one per page range when a single document is printed on several devices
+def make_jobs(args, device_count):
+    if args.testpage:
+        return [("test page", lambda device: print_font_test_page(device.file, args.quality))] * device_count, True
+    if args.merge:
+        doc = open_document(args.paths[0])
+        if args.preflight:
+            preflight(doc, args, args.paths[0])
+        template = Template(doc, merge=True)
+        if args.preflight:
+            problems = check_template(template, args)
+            if problems:
+                raise DocumentProblems(["%s: %s" % (args.paths[0], problem) for problem in problems])
+        records = enumerate(read_records(args.merge), 1)
+        lock = Lock()
+        # one merge per device, the devices share the records
+        return [("merge %s" % args.merge, lambda device: print_merge(args, device.file, template, records, lock, device.layout_cache))] * device_count, True
+    if len(args.paths) > 1 or device_count == 1:
+        jobs = []
+        for path in args.paths:
+            job_args = argparse.Namespace(**vars(args))
+            job_args.path = path
+            jobs.append((path, lambda device, job_args=job_args: print_odt(job_args, device.file, layout_cache=device.layout_cache)))
+        return jobs, False
+    doc = open_document(args.paths[0])
+    if args.preflight:
+        preflight(doc, args, args.paths[0])
+    locator = PageLocator(doc.parse_paragraphs())
+    page_count = locator.last_page[-1] if locator.last_page else 1
+    pages = [p for p in args.pages if p <= page_count]
+    if not pages:
+        print("%s: no pages selected, the document has %d pages" % (args.paths[0], page_count), file=sys.stderr)
+    jobs = []
+    for pages in split_pages(pages, device_count):
+        job_args = argparse.Namespace(**vars(args))
+        job_args.path = args.paths[0]
+        job_args.pages = pages
+        job_args.preflight = False # checked above
+        name = "%s pages %d-%d" % (job_args.path, pages[0], pages[-1])
+        jobs.append((name, lambda device, job_args=job_args: print_odt(job_args, device.file, doc, device.layout_cache)))
+    return jobs, False
+
+# runs jobs on devices, with per_device set jobs[i] runs on device i
+# otherwise each device takes the next job as soon as it is idle
+def run_jobs(devices, jobs, per_device=False):
+    if per_device:
+        queues = [Queue() for device in devices]
+        for queue, job in zip(queues, jobs):
+            queue.put(job)
+    else:
+        queues = [Queue()] * len(devices)
+        for job in jobs:
+            queues[0].put(job)
+    errors = []
+
+    def worker(device, queue):
+        while not errors:
+            try:
+                name, job = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                pages = job(device)
+            except Exception as error:
+                errors.append(error)
+                return
+            if not pages:
+                continue # nothing was sent to the device
+            device.pages += pages
+            device.jobs += 1
+            if len(devices) > 1:
+                print("%s: finished %s (%d jobs, %d pages, %.0f%% layout cache hits)" % (device.name, name, device.jobs, device.pages, device.layout_cache.hit_rate() * 100), file=sys.stderr)
+
+    if len(devices) == 1:
+        worker(devices[0], queues[0])
+    else:
+        threads = [Thread(target=worker, args=(device, queue)) for device, queue in zip(devices, queues)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Print ODT documents with dot matrix printers that support the ESC/P2 format')
-    parser.add_argument('--output', '-o', dest='output_filename', default=None, help='output device')
+    parser.add_argument('--output', '-o', dest='outputs', metavar='OUTPUT', action='append', help='output device or tcp://host:port, repeat to print on several devices')
+    parser.add_argument('--timeout', dest='timeout', type=float, default=30, help='network timeout in seconds for tcp://host:port outputs')
     parser.add_argument('--testpage', '-t', dest='testpage', action='store_true', help='print a test page with font samples')
     parser.add_argument('--character-table', '-c', dest='character_table', default="PC1250", help='select a character table, for example PC437, PC1250')
     parser.add_argument('--page', '-p', dest='pages', help='start from given page number')
     parser.add_argument('--odd', '-d', dest='odd', action='store_true', help='print only odd pages')
     parser.add_argument('--even', '-e', dest='even', action='store_true', help='print only even pages')
-    parser.add_argument('path', nargs='?', help='path to an ODT file')
+    parser.add_argument('--quality', '-q', dest='quality', choices=list(print_qualities), default='lq', help='print quality, draft is faster and uses a fixed pitch')
+    parser.add_argument('--draft-pages', dest='draft_pages', default='', help='pages to print in draft quality, for example 1-3,7')
+    parser.add_argument('--merge', '-m', dest='merge', default=None, help='CSV or JSON lines file with records, prints the document once per record with {{name}} markers and user fields replaced')
+    parser.add_argument('--check', dest='check_only', action='store_true', help='only check the documents and report problems that would stop printing')
+    parser.add_argument('--no-check', dest='preflight', action='store_false', help='start printing without checking the document first')
+    parser.add_argument('paths', nargs='*', metavar='path', help='path to an ODT or FODT file or - for stdin, several files are printed as a batch')
     args = parser.parse_args()
 
     if args.pages:
@@ -546,21 +1304,37 @@ if __name__ == "__main__":
         args.pages = [p for p in args.pages if p % 2]
     elif args.even:
         args.pages = [p for p in args.pages if p % 2 == 0]
+    args.draft_pages = parse_page_ranges(args.draft_pages)
 
 
     # validation
-    if not args.testpage and (not args.path or not os.path.exists(args.path)):
+    if not args.testpage and (not args.paths or not all(path == "-" or os.path.exists(path) for path in args.paths)):
         parser.print_help()
         exit()
 
-    if args.output_filename:
-        f = os.open(args.output_filename, os.O_WRONLY)
-    else:
-        f = 1 # stdout handle
-
-    if args.testpage:
-        print_font_test_page(f)
-    else:
-        print_odt(args, f)
+    if args.check_only:
+        problems = []
+        for path in args.paths:
+            doc = open_document(path)
+            doc_problems = check_document(doc, args)
+            problems += ["%s: %s" % (path, problem) for problem in doc_problems]
+            if args.merge and not doc_problems:
+                template = Template(doc, merge=True)
+                problems += ["%s: %s" % (path, problem) for problem in check_template(template, args)]
+                selection = select_pages(args)
+                for number, fields in enumerate(read_records(args.merge), 1):
+                    problems += ["%s: record %d: %s" % (path, number, problem) for problem in check_record(template, fields, args, selection)]
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        exit(1 if problems else 0)
 
-    os.close(f)
+    devices = [Device(name, args.timeout) for name in args.outputs or [None]]
+    try:
+        run_jobs(devices, *make_jobs(args, len(devices)))
+    except DocumentProblems as error:
+        for problem in error.problems:
+            print(problem, file=sys.stderr)
+        exit(1)
+    finally:
+        for device in devices:
+            device.close()
@@ -1,5 +1,6 @@
 import xml.etree.ElementTree as ET
 import zipfile
+from bisect import bisect_left, bisect_right
 from io import BytesIO
 
 ns = {
@@ -28,7 +29,7 @@ known_styles = {
 
 def to_inches(value):
     if type(value) == str:
-        assert value[-2:] == "in"
+        assert value[-2:] == "in", "Unsupported length %s, only inches are supported" % value
         return float(value[:-2])
     elif value == 0:
         return value
@@ -43,15 +44,44 @@ def parse_style(style):
     if psn:
         result['parent-style-name'] = psn
     for c in style:
-        keys = known_styles.get(c.tag)
-        assert not keys is None, "Unknown style tag %s" % c.tag
-        for s in keys:
+        # unsupported properties are ignored
+        for s in known_styles.get(c.tag, []):
             key = to_ns(s)
             s = s.split(':')[-1] # drop namespace
             if key in c.attrib:
                 result[s] = c.attrib.get(key)
     return result
 
+# styles of a document by name
+# a style and its parents are only parsed when the style is used, most styles of a template never are
+class StyleSheet:
+    def __init__(self):
+        self.elements = {} # style name -> style element
+        self.resolved = {} # style name -> properties including inherited ones
+
+    def add(self, element):
+        style_name = element.attrib.get(to_ns("style:name"))
+        if style_name:
+            self.elements[style_name] = element
+
+    def __contains__(self, style_name):
+        return style_name in self.elements
+
+    def __getitem__(self, style_name):
+        style = self.resolved.get(style_name)
+        if style is None:
+            style = parse_style(self.elements[style_name])
+            parent_name = style.pop('parent-style-name', None)
+            if parent_name:
+                for key, value in self[parent_name].items():
+                    if not key in style:
+                        style[key] = value
+            self.resolved[style_name] = style
+        return style
+
+    def get(self, style_name, default=None):
+        return self[style_name] if style_name in self else default
+
 def merge_styles(*styles):
     res = {}
     for s in styles:
@@ -81,7 +111,7 @@ class Paragraph:
         result.margin_right = to_inches(style.get('margin-right', 0))
         result.text_indent = to_inches(style.get('text-indent', 0))
         line_height = style.get('line-height', "100%")
-        assert line_height[-1] == "%"
+        assert line_height[-1] == "%", "Unsupported line height %s, only percentages are supported" % line_height
         result.line_height_factor = int(line_height[:-1]) / 100
         result.is_break = style.get('break-before') == "page"
         if index == 0:
@@ -90,34 +120,101 @@ class Paragraph:
         result.style = style
         return result
 
+# records on which page each paragraph starts and ends without parsing its text
+class PageLocator:
+    def __init__(self, paragraphs):
+        self.first_page = [] # page number at the start of each paragraph
+        self.last_page = [] # page number at the end of each paragraph
+        soft_page_break = to_ns("text:soft-page-break")
+        page = 1
+        for p in paragraphs:
+            if p.is_break:
+                page += 1
+            self.first_page.append(page)
+            for _ in p.element.iter(soft_page_break):
+                page += 1
+            self.last_page.append(page)
+
+    # returns the range of paragraph indices that can affect the given pages
+    def paragraph_range(self, first, last):
+        start = bisect_left(self.last_page, first)
+        # a paragraph starting with a page break ends the previous page
+        stop = bisect_right(self.first_page, last + 1)
+        return range(start, stop)
+
+    def intersects(self, index, pages):
+        return any(p in pages for p in range(self.first_page[index], self.last_page[index] + 1))
+
 class ODT:
-    def __init__(self, filename):
-        self.styles = {}
+    # source is a path or a binary stream of a zipped (.odt) or flat (.fodt) document
+    def __init__(self, source):
+        self.styles = StyleSheet()
+        self.paragraph_elements = None # (element, index) of paragraphs found while parsing a flat document
 
-        z = zipfile.ZipFile(filename)
+        if hasattr(source, 'read') and not source.seekable():
+            # zipfile needs to seek, read pipes into memory
+            source = BytesIO(source.read())
+        is_zip = zipfile.is_zipfile(source)
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        if not is_zip:
+            self.load_flat(source)
+            return
+
+        z = zipfile.ZipFile(source)
         content = z.read('content.xml')
 
         root = ET.fromstring(content)
-        styles = root.find('office:automatic-styles', ns)
-        for s in styles:
-            self.styles[s.attrib[to_ns("style:name")]] = parse_style(s)
+        for s in root.find('office:automatic-styles', ns):
+            self.styles.add(s)
         self.body = root.find('office:body', ns)
         self.text = self.body.find('office:text', ns)
 
         # styles.xml
         styles = z.read('styles.xml')
         root = ET.fromstring(styles)
-        styles = root.find('office:styles', ns)
-        for s in styles:
-            style_name = s.attrib.get(to_ns("style:name"))
-            if style_name is None: continue
-            self.styles[style_name] = parse_style(s)
+        for s in root.find('office:styles', ns):
+            self.styles.add(s)
 
         # parse page style
-        styles = root.find('office:automatic-styles', ns)
-        for s in styles:
-            self.styles[s.attrib[to_ns("style:name")]] = parse_style(s)
-        master = root.find('office:master-styles', ns)
+        for s in root.find('office:automatic-styles', ns):
+            self.styles.add(s)
+        self.load_page_layout(root.find('office:master-styles', ns))
+
+    # parses a flat document in a single pass
+    # paragraphs are only recorded, their styles are looked up by parse_paragraphs
+    # the text is kept in memory, page selection and merging need all paragraphs before printing
+    # the other top level sections are cleared as soon as they are read
+    def load_flat(self, source):
+        style_containers = [to_ns("office:styles"), to_ns("office:automatic-styles")]
+        kept_sections = style_containers + [to_ns("office:body")]
+        paragraph_tags = [to_ns("text:h"), to_ns("text:p")]
+        self.paragraph_elements = []
+        stack = []
+        text_index = None # index of elements in document order within office:text
+        for event, element in ET.iterparse(source, events=("start", "end")):
+            if event == "start":
+                if element.tag == to_ns("office:text"):
+                    self.body = stack[-1]
+                    self.text = element
+                    text_index = 0
+                elif text_index is not None:
+                    text_index += 1
+                    if element.tag in paragraph_tags:
+                        self.paragraph_elements.append((element, text_index))
+                stack.append(element)
+                continue
+
+            stack.pop()
+            if stack and stack[-1].tag in style_containers:
+                self.styles.add(element)
+            elif element.tag == to_ns("office:master-styles"):
+                self.load_page_layout(element)
+                element.clear()
+            elif len(stack) == 1 and element.tag not in kept_sections:
+                element.clear()
+
+    def load_page_layout(self, master):
         master_page = master.find('style:master-page', ns)
         master_page_style = master_page.attrib.get(to_ns('style:page-layout-name'))
         mps = self.styles[master_page_style]
@@ -128,38 +225,39 @@ class ODT:
                 pass
             setattr(self, key.replace('-', '_'), value)
 
-        # 2nd pass: merge all parent styles recursively
-        def merge_parent_style(style):
-            if style.get('parent-style-name'):
-                parent = self.styles[style['parent-style-name']]
-                merge_parent_style(parent)
-                for key, value in parent.items():
-                    if not key in style:
-                        style[key] = value
-                del style['parent-style-name']
-        for style in self.styles.values():
-            merge_parent_style(style)
+    # returns (element, index) of all paragraphs and headings, index counts the elements within office:text
+    def get_paragraph_elements(self):
+        if self.paragraph_elements is not None:
+            return self.paragraph_elements
+        paragraph_tags = [to_ns("text:h"), to_ns("text:p")]
+        return [(p, i) for i, p in enumerate(self.text.iter()) if p.tag in paragraph_tags]
 
     def parse_paragraphs(self):
-        paragraphs = self.text.iter()
         result = []
-        for i, p in enumerate(paragraphs):
-            if p.tag in [to_ns("text:h"), to_ns("text:p")]:
-                style_name = p.attrib.get(to_ns('text:style-name'))
-                style = self.styles[style_name]
-                result.append(Paragraph.from_odt_element(p, style, i))
+        for p, i in self.get_paragraph_elements():
+            style_name = p.attrib.get(to_ns('text:style-name'))
+            style = self.styles[style_name]
+            result.append(Paragraph.from_odt_element(p, style, i))
         return result
 
     # returns text and style information recursivly from the given xml element
     # returns a list of (style, text) pairs
-    def parse(self, element, style):
+    # user fields are returned as {{name}} placeholders if user_fields is set
+    # with a list as missing_styles, unknown styles are added to it and their text keeps the outer style
+    def parse(self, element, style, user_fields=False, missing_styles=None):
         result = []
         if element.text:
             result.append([style, element.text])
         for child in element:
             el_style_name = child.attrib.get(to_ns('text:style-name'))
             if el_style_name:
-                el_style = self.styles[el_style_name]
+                try:
+                    el_style = self.styles[el_style_name]
+                except KeyError as error:
+                    if missing_styles is None:
+                        raise
+                    missing_styles.append(error.args[0])
+                    el_style = {}
                 sub_style = merge_styles(style, el_style)
             else:
                 sub_style = merge_styles(style)
@@ -178,8 +276,10 @@ class ODT:
                 result.append([sub_style, " " * spaceCount])
             if tag == to_ns("text:soft-page-break"):
                 result.append([sub_style, "\f"])
+            elif user_fields and tag == to_ns("text:user-field-get"):
+                result.append([sub_style, "{{%s}}" % child.attrib.get(to_ns("text:name"))])
             else:
-                result.extend(self.parse(child, sub_style))
+                result.extend(self.parse(child, sub_style, user_fields, missing_styles))
             if child.tail:
                 result.append([style, child.tail])
         return result
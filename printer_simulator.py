@@ -0,0 +1,314 @@
+import argparse
+import os
+import socket
+import sys
+import time
+from threading import Thread, Condition
+
+# Simulates an ESC/P2 printer to measure how long a job takes without printing it.
+# Data arrives over a link of limited bandwidth into an input buffer of limited size. When the
+# buffer is full, the printer stops reading and the host has to wait. The printer takes commands
+# from the buffer and spends time on them: every command takes a fixed processing time, every
+# printed line takes the head travel across it and every vertical move takes paper feed time.
+# The simulation runs in real time, so the host sees the same back pressure as from a printer.
+
+# number of parameter bytes of ESC commands, others have no parameters
+# ESC ( and ESC & have a length of their own
+parameter_counts = {ord(c): 1 for c in "!+-3ACJQRSUWaklprtwx%"}
+parameter_counts[ord('$')] = 2
+parameter_counts[ord('\\')] = 2
+parameter_counts[ord('X')] = 3
+
+# returns the length of the command or run of printable characters at the start of data
+# returns None if the command is incomplete
+def command_length(data):
+    c = data[0]
+    if c != 0x1b:
+        if c < 0x20:
+            return 1
+        n = 1
+        while n < len(data) and data[n] >= 0x20 and data[n] != 0x1b:
+            n += 1
+        return n
+    if len(data) < 2:
+        return None
+    c = data[1]
+    if c == ord('('):
+        # ESC ( c nL nH and n bytes of parameters
+        if len(data) < 5:
+            return None
+        n = 5 + data[3] + data[4] * 256
+    elif c == ord('&'):
+        # ESC & 0 n m, then a0 a1 a2 and a1 columns of 3 bytes for each character from n to m
+        if len(data) < 5:
+            return None
+        n = 5
+        for _ in range(data[4] - data[3] + 1):
+            if len(data) < n + 3:
+                return None
+            n += 3 + 3 * data[n + 1]
+    else:
+        n = 2 + parameter_counts.get(c, 0)
+    return n if n <= len(data) else None
+
+# Time the printer spends on commands. Positions are in 1/360 inch, speeds in inch per second.
+class PrinterModel:
+    def __init__(self, lq_speed=15, draft_speed=45, line_time=0.02, feed_speed=3, feed_time=0.01, command_time=0.0002):
+        self.head_speeds = {'lq': lq_speed, 'draft': draft_speed}
+        self.line_time = line_time # turnaround of the head for each printed line
+        self.feed_speed = feed_speed
+        self.feed_time = feed_time # start of each paper feed
+        self.command_time = command_time
+        self.lines = 0
+        self.pages = 0
+        self.commands = 0
+        self.reset()
+
+    def reset(self):
+        self.quality = 'lq'
+        self.proportional = False
+        self.scale = 1
+        self.line_spacing = 60
+        self.page_length = 11 * 360
+        self.x = 0
+        self.y = 0
+        self.head = 0 # position of the head after the last printed line
+        self.line_start = None # leftmost printed position of the current line
+        self.line_end = 0 # rightmost printed position of the current line
+
+    # average advance of a character
+    def character_width(self):
+        if self.proportional:
+            return 30 * self.scale
+        return 36
+
+    # prints the current line, returns the time taken
+    # the head prints in both directions and starts at the end of the line that is closer
+    def print_line(self):
+        if self.line_start is None:
+            return 0
+        width = self.line_end - self.line_start
+        if abs(self.head - self.line_start) <= abs(self.head - self.line_end):
+            travel = abs(self.head - self.line_start) + width
+            self.head = self.line_end
+        else:
+            travel = abs(self.head - self.line_end) + width
+            self.head = self.line_start
+        self.line_start = None
+        self.lines += 1
+        return self.line_time + travel / 360 / self.head_speeds[self.quality]
+
+    def feed(self, distance):
+        self.y += distance
+        return self.print_line() + self.feed_time + distance / 360 / self.feed_speed
+
+    # returns the time the printer takes for a command or a run of printable characters
+    def execute(self, data):
+        c = data[0]
+        if c >= 0x20:
+            if self.line_start is None:
+                self.line_start = self.line_end = self.x
+            self.x += len(data) * self.character_width()
+            self.line_end = max(self.line_end, self.x)
+            return 0
+        if c == 0x0d: # carriage return
+            self.x = 0
+            return self.print_line()
+        if c == 0x0a: # line feed
+            return self.feed(self.line_spacing)
+        if c == 0x0c: # form feed
+            self.pages += 1
+            result = self.feed(max(self.page_length - self.y, 0))
+            self.y = 0
+            return result
+        if c != 0x1b:
+            return 0
+
+        self.commands += 1
+        c = chr(data[1])
+        if c == '@':
+            self.reset()
+        elif c == '2':
+            self.line_spacing = 60
+        elif c == '3':
+            self.line_spacing = data[2] * 2
+        elif c == 'x':
+            self.quality = 'lq' if data[2] else 'draft'
+        elif c == 'p':
+            self.proportional = data[2] == 1
+        elif c == 'X':
+            if data[3]:
+                self.scale = data[3] / 2 / 10.5
+        elif c == '$':
+            self.x = (data[2] + data[3] * 256) * 6
+        elif c == '(' and data[2] == ord('v'):
+            return self.command_time + self.feed(data[5] + data[6] * 256)
+        elif c == '(' and data[2] == ord('c'):
+            self.page_length = data[7] + data[8] * 256
+        return self.command_time
+
+# Receives jobs and plays them through a PrinterModel in real time
+class SimulatedPrinter:
+    def __init__(self, model, bandwidth=100000, buffer_size=65536, min_gap=0.01):
+        self.model = model
+        self.bandwidth = bandwidth # bytes per second
+        self.buffer_size = buffer_size
+        self.min_gap = min_gap # shorter idle times are not reported as gaps
+        self.jobs = 0
+
+    # read(n) returns up to n bytes of the job and b"" at its end
+    # returns a dict with the statistics of the job
+    def run_job(self, read):
+        model = self.model
+        model.reset()
+        model.lines = model.pages = model.commands = 0
+        buffer = bytearray()
+        condition = Condition()
+        state = {'eof': False, 'first_byte': None, 'bytes': 0, 'buffer_full': 0}
+
+        def receive():
+            link_clock = 0
+            while 1:
+                with condition:
+                    if len(buffer) >= self.buffer_size:
+                        full_since = time.perf_counter()
+                        while len(buffer) >= self.buffer_size:
+                            condition.wait()
+                        state['buffer_full'] += time.perf_counter() - full_since
+                    room = self.buffer_size - len(buffer)
+                data = read(min(room, 4096))
+                now = time.perf_counter()
+                if state['first_byte'] is None:
+                    state['first_byte'] = now
+                if data:
+                    # the link delivers the data no faster than its bandwidth
+                    link_clock = max(link_clock, now) + len(data) / self.bandwidth
+                    if link_clock > now:
+                        time.sleep(link_clock - now)
+                with condition:
+                    if not data:
+                        state['eof'] = True
+                    buffer.extend(data)
+                    state['bytes'] += len(data)
+                    condition.notify_all()
+                if not data:
+                    return
+
+        receiver = Thread(target=receive, daemon=True)
+        receiver.start()
+
+        clock = None # time at which the printer is done with the commands taken so far
+        gaps = []
+        while 1:
+            with condition:
+                while 1:
+                    n = command_length(buffer) if buffer else None
+                    if n is not None or state['eof'] or len(buffer) >= self.buffer_size:
+                        break
+                    condition.wait()
+                if n is None and not state['eof']:
+                    raise Exception("A command is longer than the input buffer of %d bytes" % self.buffer_size)
+                if n is None:
+                    break
+                command = bytes(buffer[:n])
+                del buffer[:n]
+                condition.notify_all()
+            now = time.perf_counter()
+            if clock is None:
+                clock = now
+            elif now > clock:
+                # the printer ran out of data
+                if now - clock >= self.min_gap:
+                    gaps.append(now - clock)
+                clock = now
+            clock += model.execute(command)
+            if clock - time.perf_counter() > 0.005:
+                time.sleep(clock - time.perf_counter())
+        receiver.join()
+        if clock is None:
+            return None
+        clock += model.print_line()
+        if clock > time.perf_counter():
+            time.sleep(clock - time.perf_counter())
+
+        self.jobs += 1
+        return {
+            'bytes': state['bytes'],
+            'pages': model.pages,
+            'lines': model.lines,
+            'commands': model.commands,
+            'duration': clock - state['first_byte'],
+            'idle_gaps': gaps,
+            'buffer_full': state['buffer_full'],
+        }
+
+def format_report(job, result):
+    gaps = result['idle_gaps']
+    lines = [
+        "Job %d: %d bytes, %d pages, %d lines, %d commands" % (job, result['bytes'], result['pages'], result['lines'], result['commands']),
+        "  duration %.2f s from the first byte to the last printed line" % result['duration'],
+        "  idle %.2f s in %d gaps, longest %.2f s" % (sum(gaps), len(gaps), max(gaps, default=0)),
+        "  input buffer full for %.2f s" % result['buffer_full'],
+    ]
+    return "\n".join(lines)
+
+def report(printer, result):
+    if result:
+        print(format_report(printer.jobs, result), flush=True)
+
+# every connection is a job
+def serve_socket(printer, host, port, once=False):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # keep the kernel from buffering much more than the printer
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    server.bind((host, port))
+    server.listen(1)
+    print("Listening on %s:%d" % (host, port), flush=True)
+    while 1:
+        connection, _ = server.accept()
+        with connection:
+            report(printer, printer.run_job(connection.recv))
+        if once:
+            return
+
+# every time the FIFO is opened and closed by a writer is a job
+def serve_fifo(printer, path, once=False):
+    if not os.path.exists(path):
+        os.mkfifo(path)
+    print("Reading from %s" % path, flush=True)
+    while 1:
+        with open(path, 'rb', buffering=0) as f:
+            report(printer, printer.run_job(f.read))
+        if once:
+            return
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Simulate an ESC/P2 printer and report how long jobs take')
+    parser.add_argument('--port', type=int, help='accept jobs on a TCP port, print with -o tcp://localhost:PORT')
+    parser.add_argument('--host', default='localhost', help='address to listen on')
+    parser.add_argument('--fifo', help='accept jobs from a FIFO, which is created if needed, print with -o FIFO')
+    parser.add_argument('--bandwidth', type=float, default=100000, help='link bandwidth in bytes per second')
+    parser.add_argument('--buffer', type=int, default=65536, help='size of the input buffer in bytes')
+    parser.add_argument('--lq-speed', type=float, default=15, help='head speed in letter quality in inch per second')
+    parser.add_argument('--draft-speed', type=float, default=45, help='head speed in draft quality in inch per second')
+    parser.add_argument('--line-time', type=float, default=0.02, help='time per printed line in seconds in addition to head travel')
+    parser.add_argument('--feed-speed', type=float, default=3, help='paper feed speed in inch per second')
+    parser.add_argument('--feed-time', type=float, default=0.01, help='time to start each paper feed in seconds')
+    parser.add_argument('--command-time', type=float, default=0.0002, help='processing time per ESC command in seconds')
+    parser.add_argument('--min-gap', type=float, default=0.01, help='shortest idle time in seconds that is reported as a gap')
+    parser.add_argument('--once', action='store_true', help='exit after the first job')
+    args = parser.parse_args()
+
+    if (args.port is None) == (args.fifo is None):
+        print("Either --port or --fifo is required", file=sys.stderr)
+        sys.exit(1)
+    model = PrinterModel(args.lq_speed, args.draft_speed, args.line_time, args.feed_speed, args.feed_time, args.command_time)
+    printer = SimulatedPrinter(model, args.bandwidth, args.buffer, args.min_gap)
+    try:
+        if args.port is not None:
+            serve_socket(printer, args.host, args.port, args.once)
+        else:
+            serve_fifo(printer, args.fifo, args.once)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,129 @@
+import select
+import socket
+import time
+from urllib.parse import urlsplit
+
+default_port = 9100
+
+# Sends raw ESC/P2 data to a network print server (JetDirect / port 9100)
+# The connection is kept open across jobs. Data is buffered and sent once per page or when the buffer is full.
+# sendall only hands data to the kernel, so a page counts as delivered once the next page boundary has been
+# reached on the same connection. If the connection drops, it is reopened, a partially printed sheet is ejected,
+# the printer setup is sent again and the pages that may not have arrived are sent once more.
+class TcpOutput:
+    def __init__(self, host, port=default_port, timeout=30, buffer_size=16384, retries=3, retry_delay=1):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.buffer_size = buffer_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.socket = None
+        self.buffer = bytearray() # data not yet sent
+        self.page = bytearray() # data of the current page that has been sent
+        self.page_started = False # the printer may have received part of the current page
+        self.setup = None # returns the commands that restore the printer state at the start of the current page
+        self.previous = bytearray() # sent pages before the current one that are not known to be delivered
+        self.previous_setup = None # setup at the start of the previous pages
+        self.last_send = None # time of the last successful send
+        self.connections = 0
+
+    @staticmethod
+    def from_url(url, **kwargs):
+        parts = urlsplit(url)
+        assert parts.scheme == "tcp" and parts.hostname, "Invalid output URL " + url
+        return TcpOutput(parts.hostname, parts.port or default_port, **kwargs)
+
+    def connect(self):
+        self.socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.connections += 1
+
+    def disconnect(self):
+        if self.socket:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+        self.socket = None
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        data = bytes(self.buffer)
+        self.buffer = bytearray()
+        self.send(data)
+        self.page += data
+
+    # returns False if the print server closed the connection
+    def is_connected(self):
+        if self.socket is None:
+            return False
+        try:
+            readable, _, _ = select.select([self.socket], [], [], 0)
+            return not readable or self.socket.recv(1, socket.MSG_PEEK) != b""
+        except OSError:
+            return False
+
+    # called after each form feed
+    # setup is a function that returns the commands which restore the printer state at the start of the next page
+    # it is only called when the connection has to be reopened
+    def page_boundary(self, setup=None):
+        self.flush()
+        if not self.previous or self.is_connected():
+            # the connection is still open after the current page was sent, so the previous pages have arrived
+            self.previous = self.page
+            self.previous_setup = self.setup
+        else:
+            self.previous += self.page
+        self.page = bytearray()
+        self.page_started = False
+        self.setup = setup
+
+    # returns the data to send first on a new connection
+    def resend_data(self):
+        if self.previous:
+            # the previous page may have been cut off, it is printed on a new sheet
+            setup = self.previous_setup() if self.previous_setup else b""
+            return b"\r\f" + setup + self.previous + self.page
+        setup = self.setup() if self.setup else b""
+        return (b"\r\f" if self.page_started else b"") + setup + self.page
+
+    def send(self, data):
+        if self.socket is not None and not self.is_connected():
+            self.disconnect()
+            if self.timeout and self.last_send is not None and time.monotonic() - self.last_send > self.timeout:
+                # the print server closed an idle connection after it took all data, nothing is sent again
+                self.previous = bytearray()
+                self.page = bytearray()
+                self.page_started = False
+                self.setup = None
+        attempt = 0
+        while 1:
+            payload = data
+            try:
+                if self.socket is None:
+                    reconnect = self.connections > 0
+                    self.connect()
+                    if reconnect:
+                        # the printer lost its state and possibly data that was sent
+                        payload = self.resend_data() + data
+                self.page_started = True
+                self.socket.sendall(payload)
+                self.last_send = time.monotonic()
+                return
+            except OSError as error:
+                self.disconnect()
+                attempt += 1
+                if attempt > self.retries:
+                    raise Exception("Cannot send to %s:%d: %s" % (self.host, self.port, error))
+                time.sleep(self.retry_delay)
+
+    def close(self):
+        self.flush()
+        self.disconnect()
@@ -0,0 +1,53 @@
+import pytest
+
+from conftest import paragraph
+from odt2escp import DocumentProblems, Template, check_document, check_template, open_document, preflight
+from test_jobs import job_args
+
+styles = """
+<style:style style:name="Metric" style:family="paragraph" style:parent-style-name="Standard">
+<style:paragraph-properties fo:margin-left="1cm"/>
+</style:style>
+<style:style style:name="Odd" style:family="text"><style:text-properties fo:font-size="13pt"/></style:style>
+"""
+
+def test_problems_are_reported_in_document_order(make_document):
+    path = make_document("\n".join([
+        paragraph('<text:span text:style-name="Odd">first</text:span>'),
+        paragraph("second", "Metric"),
+        paragraph('<text:span text:style-name="Odd">third</text:span>', "Break"),
+        paragraph("fourth", "Metric"),
+    ]), styles=styles)
+    size = "Unsupported font size 13.0pt, it has to be one of "
+    length = "Unsupported length 1cm, only inches are supported"
+    expected = [
+        "Page 1, paragraph 1: " + size,
+        "Page 1, paragraph 2: " + length,
+        "Page 2, paragraph 3: " + size,
+        "Page 2, paragraph 4: " + length,
+    ]
+    problems = check_document(open_document(path), job_args([path]))
+    assert len(problems) == len(expected)
+    assert all(problem.startswith(start) for problem, start in zip(problems, expected))
+
+def test_unknown_character_table_is_reported_before_printing(make_document):
+    path = make_document(paragraph("text"))
+    args = job_args([path], character_table="PC999")
+    with pytest.raises(DocumentProblems) as error:
+        preflight(open_document(path), args, path)
+    assert error.value.problems == [path + ": Unsupported character table PC999"]
+
+def test_placeholders_may_contain_spaces(make_document):
+    path = make_document(paragraph("Dear {{ First name }} {{last-name}},"))
+    template = Template(open_document(path), merge=True)
+    runs = template.get_runs(0, {"First name": "Ada", "last-name": "Lovelace"})
+    assert [text for font_style, text in runs] == ["Dear Ada Lovelace,"]
+
+def test_placeholder_with_two_formats_is_reported(make_document):
+    path = make_document("\n".join([
+        paragraph('{{name}} and {{na<text:span text:style-name="Bold">me</text:span>}}'),
+        paragraph('<text:span text:style-name="Bold">{{name}}</text:span>'),
+    ]))
+    template = Template(open_document(path), merge=True)
+    assert check_template(template, job_args([path])) == [
+        "Page 1, paragraph 1: the placeholder {{name}} changes its formatting, it is not replaced"]
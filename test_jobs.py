@@ -0,0 +1,95 @@
+import argparse
+from threading import Thread
+
+import pytest
+
+from conftest import pages_body
+from odt2escp import Device, make_jobs, run_jobs, render
+
+def job_args(paths, **options):
+    args = argparse.Namespace(testpage=False, merge=None, paths=paths, pages=range(1, 10000),
+        character_table="PC1250", quality="lq", draft_pages=[], preflight=True)
+    vars(args).update(options)
+    return args
+
+def open_devices(tmp_path, count):
+    devices = []
+    for i in range(count):
+        path = tmp_path / ("device%d" % i)
+        path.write_bytes(b"")
+        devices.append(Device(str(path)))
+    return devices
+
+def read_devices(devices):
+    for device in devices:
+        device.close()
+    return [open(device.name, 'rb').read() for device in devices]
+
+# runs run_jobs in a thread, so that a hang fails the test instead of blocking it
+def run_jobs_with_timeout(devices, jobs, per_device):
+    errors = []
+    def run():
+        try:
+            run_jobs(devices, jobs, per_device)
+        except Exception as error:
+            errors.append(error)
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+    assert not thread.is_alive(), "run_jobs did not return"
+    return errors
+
+def test_each_document_is_printed_in_full_on_exactly_one_device(make_document, tmp_path):
+    paths = [make_document(pages_body(1 + i % 3, name="Document %d" % i), name="document%d.fodt" % i) for i in range(6)]
+    devices = open_devices(tmp_path, 2)
+    jobs, per_device = make_jobs(job_args(paths), len(devices))
+    assert not per_device
+    assert run_jobs_with_timeout(devices, jobs, per_device) == []
+    data = read_devices(devices)
+    expected = [render(path) for path in paths]
+    for document in expected:
+        assert sum(output.count(document) for output in data) == 1
+    assert sum(map(len, data)) == sum(map(len, expected))
+    assert sum(device.jobs for device in devices) == len(paths)
+
+def test_jobs_for_each_device_run_on_that_device(make_document, tmp_path):
+    paths = [make_document(pages_body(2, name="Document %d" % i), name="document%d.fodt" % i) for i in range(2)]
+    devices = open_devices(tmp_path, 2)
+    jobs, per_device = make_jobs(job_args(paths), len(devices))
+    assert run_jobs_with_timeout(devices, jobs, True) == []
+    assert read_devices(devices) == [render(path) for path in paths]
+
+def test_single_document_is_split_into_page_ranges(make_document, tmp_path):
+    path = make_document(pages_body(5))
+    devices = open_devices(tmp_path, 2)
+    jobs, per_device = make_jobs(job_args([path]), len(devices))
+    assert [name for name, job in jobs] == [path + " pages 1-3", path + " pages 4-5"]
+    assert run_jobs_with_timeout(devices, jobs, per_device) == []
+    data = read_devices(devices)
+    expected = [render(path, pages=[1, 2, 3]), render(path, pages=[4, 5])]
+    for pages in expected:
+        assert sum(output.count(pages) for output in data) == 1
+    assert sum(map(len, data)) == sum(map(len, expected))
+
+class FailingOutput:
+    def write(self, data):
+        raise OSError("device is offline")
+
+    def close(self):
+        pass
+
+@pytest.mark.parametrize("per_device", [False, True])
+def test_failing_device_does_not_hang_the_queue(make_document, tmp_path, per_device):
+    paths = [make_document(pages_body(1, name="Document %d" % i), name="document%d.fodt" % i) for i in range(4)]
+    devices = open_devices(tmp_path, 2)
+    # the first worker is started first, so the failing device takes a job
+    devices[0].file.close()
+    devices[0].file = FailingOutput()
+    jobs, _ = make_jobs(job_args(paths), len(devices))
+    errors = run_jobs_with_timeout(devices, jobs, per_device)
+    assert [str(error) for error in errors] == ["device is offline"]
+    devices[1].close()
+    # the jobs that were finished on the working device are complete
+    data = open(devices[1].name, 'rb').read()
+    finished = [render(path) for path in paths if render(path) in data]
+    assert len(data) == sum(map(len, finished))
@@ -0,0 +1,88 @@
+import re
+from io import BytesIO
+
+from odt2escp import PrinterOutput, StreamOutput
+from parse_odt import Paragraph
+
+font = ("EpsonRomanProportional", 10.5, None, None, None, None)
+
+# returns the parameters of all ESC ( v commands in 1/360 inch
+def vertical_moves(data):
+    return [int.from_bytes(m, 'little', signed=True) for m in re.findall(rb"\x1b\(v\x02\x00(..)", data, re.S)]
+
+def print_paragraphs(*paragraphs):
+    stream = BytesIO()
+    printer = PrinterOutput(StreamOutput(stream))
+    for paragraph, text in paragraphs:
+        printer.new_paragraph(paragraph)
+        printer.print_paragraph([(font, text)])
+    printer.end()
+    return stream.getvalue()
+
+def paragraph(margin_bottom=0):
+    result = Paragraph()
+    result.margin_bottom = margin_bottom
+    return result
+
+def test_line_feed_is_not_part_of_a_move_across_the_page_bottom():
+    # the margin ends below the printable area, the printer ignores the move
+    data = print_paragraphs((paragraph(margin_bottom=12), "first"), (paragraph(), "second"))
+    assert vertical_moves(data) == [12 * 360]
+    # the second line still gets its own line feed and is not printed over the first
+    assert re.search(rb"first.*\x1b\(v\x02\x00..\r\nsecond", data, re.S)
+
+def test_long_moves_are_split():
+    data = print_paragraphs((paragraph(margin_bottom=100), "first"), (paragraph(), "second"))
+    moves = vertical_moves(data)
+    assert sum(moves) == 100 * 360
+    assert all(0 < move <= 32767 for move in moves)
+
+# keeps the restore functions passed at page boundaries
+class RecordingOutput(StreamOutput):
+    def __init__(self):
+        super().__init__(BytesIO())
+        self.setups = []
+
+    def page_boundary(self, setup=None):
+        self.setups.append(setup)
+
+def test_restore_commands_are_built_on_demand_from_the_page_start():
+    output = RecordingOutput()
+    printer = PrinterOutput(output, quality="draft")
+    printer.new_paragraph(Paragraph())
+    printer.print_paragraph([(font, "page one")])
+    printer.new_page(2)
+    printer.set_quality("lq")
+    printer.print_paragraph([(font, "∞ page two")])
+    printer.new_page(3)
+    first, second = [setup() for setup in output.setups]
+    assert first.startswith(b"\x1b@")
+    assert b"\x1bx\x00" in first # draft quality at the end of page one
+    assert b"\x1bl\x04" in first # left margin
+    assert b"\x1b&\x00" not in first
+    assert b"\x1bx\x01" in second
+    assert b"\x1b&\x00" in second # the downloaded glyph is defined again
+
+def test_restore_commands_include_the_font_of_the_current_run():
+    printer = PrinterOutput(StreamOutput(BytesIO()))
+    printer.new_paragraph(Paragraph())
+    points = []
+    break_words = printer.break_words
+    def break_words_and_record(words):
+        points.append(printer.restore_point())
+        break_words(words)
+    printer.break_words = break_words_and_record
+    printer.add_text("bold", "EpsonRomanProportional", 10.5, "bold", "italic", "solid", None)
+    assert points[0]().endswith(b"\x1b4\x1bE\x1b-\x01")
+    assert not printer.restore_point()().endswith(b"\x1b4\x1bE\x1b-\x01")
+
+def test_draft_line_spacing_ignores_the_font_size():
+    big = ("EpsonRomanProportional", 14, None, None, None, None)
+    for quality, spacing in [("lq", b"\x1b3\x28"), ("draft", b"")]:
+        stream = BytesIO()
+        printer = PrinterOutput(StreamOutput(stream), quality=quality)
+        printer.new_paragraph(Paragraph())
+        printer.print_paragraph([(big, "big text")])
+        printer.end()
+        # the default spacing of 1/6 inch fits 10.5pt lines
+        assert re.search(rb"\x1bl\x04(.*)\r\n", stream.getvalue(), re.S).group(1) == spacing
@@ -0,0 +1,119 @@
+import os
+import subprocess
+import sys
+from io import BytesIO
+from threading import Thread
+
+from conftest import pages_body, paragraph, zipped_document
+from odt2escp import LayoutCache, StreamOutput, coalesce_runs, open_document, print_odt, render, render_options, render_to
+
+# runs the command line in filter mode, the document is piped to stdin
+def filter_mode(data, *options):
+    result = subprocess.run([sys.executable, "odt2escp.py", *options, "-"], input=data,
+        capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+def test_filter_mode_prints_a_piped_document_to_stdout(make_document):
+    path = make_document(pages_body(3))
+    flat = open(path, 'rb').read()
+    expected = render(path)
+    assert filter_mode(flat) == expected
+    # zipped documents are read into memory, the pipe cannot seek
+    assert filter_mode(zipped_document(flat.decode('utf-8'))) == expected
+    assert filter_mode(flat, "--page", "2") == render(path, pages=range(2, 10000))
+
+# Strong is another name for Bold
+strong = '<style:style style:name="Strong" style:family="text"><style:text-properties fo:font-weight="bold"/></style:style>'
+
+def span(text, style):
+    return '<text:span text:style-name="%s">%s</text:span>' % (style, text)
+
+def test_runs_with_the_same_font_print_like_one_run(make_document):
+    texts = ["Dear customer, your order", " has been ship", "ped.<text:tab/>Total", " due: 42"]
+    whole = "".join(texts)
+    split = make_document(paragraph(span(texts[0], "Bold") + "".join(span(t, "Strong") for t in texts[1:]) + " " + span("big", "Big")),
+        name="split.fodt", styles=strong)
+    single = make_document(paragraph(span(whole, "Bold") + " " + span("big", "Big")), name="single.fodt")
+    assert render(split) == render(single)
+
+def test_tabs_and_breaks_are_not_coalesced():
+    bold = {'font-weight': 'bold'}
+    runs = [(bold, "a"), (bold, "\t"), (bold, "b"), ({'font-weight': 'bold'}, "c"), (bold, "\f"), (bold, "d")]
+    assert [text for font_style, text in coalesce_runs(runs)] == ["a", "\t", "bc", "\f", "d"]
+
+def test_layout_cache_does_not_change_the_output(make_document):
+    boilerplate = [
+        paragraph("Terms: " + span("payable", "Bold") + " within 30 days.<text:tab/>Thank you"),
+        paragraph(span("Invoice", "Big") + " lorem ipsum dolor sit amet " * 6),
+    ]
+    body = []
+    for page in range(1, 5):
+        body.append(paragraph("Page %d" % page, "Break" if page > 1 else "Standard"))
+        body += boilerplate * 2
+    path = make_document("\n".join(body))
+    uncached = render(path, layout_cache=LayoutCache(0), draft_pages=[3])
+    cache = LayoutCache()
+    assert render(path, layout_cache=cache, draft_pages=[3]) == uncached
+    assert cache.hits > 0
+    # a warm cache, shared with the previous call
+    assert render(path, layout_cache=cache, draft_pages=[3]) == uncached
+    assert render(path, layout_cache=cache, pages=[2, 3]) == render(path, layout_cache=LayoutCache(0), pages=[2, 3])
+
+def test_render_accepts_paths_bytes_and_streams(make_document):
+    path = make_document(pages_body(3))
+    flat = open(path, 'rb').read()
+    expected = render(path)
+    assert render(flat) == expected
+    assert render(BytesIO(flat)) == expected
+    assert render(zipped_document(flat.decode('utf-8'))) == expected
+    stream = BytesIO()
+    render_to(stream, path)
+    assert stream.getvalue() == expected
+
+def test_pages_of_flat_and_zipped_documents_are_selected_alike(make_document):
+    path = make_document(pages_body(4))
+    zipped = zipped_document(open(path, encoding='utf-8').read())
+    for pages in [[2], [1, 3], [3, 4], [5]]:
+        data = render(path, pages=pages)
+        assert data == render(zipped, pages=pages)
+        for page in range(1, 5):
+            assert (b"Page %d paragraph 1" % page in data) == (page in pages)
+    # pages that are not printed in draft are not affected by it
+    assert render(path, pages=[1, 2], draft_pages=[3]) == render(path, pages=[1, 2])
+
+def test_documents_are_rendered_in_parallel(make_document):
+    paths = [make_document(pages_body(2, name="Document %d" % i), name="document%d.fodt" % i) for i in range(4)]
+    expected = [render(path) for path in paths]
+    cache = LayoutCache()
+    results = {}
+    def run(i):
+        results[i] = render(paths[i % 4], layout_cache=cache)
+    threads = [Thread(target=run, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [results[i] for i in range(16)] == expected * 4
+
+title = '''<style:style style:name="Title" style:family="paragraph" style:parent-style-name="Heading">
+<style:text-properties fo:font-size="14pt"/></style:style>'''
+heading = '''<style:style style:name="Heading" style:family="paragraph" style:parent-style-name="Standard">
+<style:paragraph-properties fo:margin-bottom="0.2in" fo:text-align="center"/><style:text-properties fo:font-weight="bold"/></style:style>'''
+unused = '<style:style style:name="Unused" style:family="paragraph" style:parent-style-name="Missing"/>'
+
+def test_styles_resolved_on_first_use_print_like_resolved_ones(make_document):
+    body = "\n".join([paragraph("Title", "Title"), paragraph("Heading", "Heading"), paragraph(span("text", "Big"))])
+    # parents may be declared after the styles that inherit from them
+    path = make_document(body, name="children_first.fodt", styles=title + heading + unused)
+    expected = render(make_document(body, name="parents_first.fodt", styles=heading + title))
+    assert render(path) == expected
+    # resolving every used style before printing gives the same result
+    doc = open_document(path)
+    assert (doc.styles["Title"]["font-weight"], doc.styles["Title"]["font-size"]) == ("bold", "14pt")
+    for name in doc.styles.elements:
+        if name != "Unused":
+            doc.styles[name]
+    stream = BytesIO()
+    print_odt(render_options(), StreamOutput(stream), doc)
+    assert stream.getvalue() == expected
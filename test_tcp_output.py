@@ -0,0 +1,116 @@
+import socket
+import time
+from threading import Thread
+
+import pytest
+
+from tcp_output import TcpOutput
+
+# A print server on localhost that records the data of each connection.
+# With close_after set, the first connection is closed after that many bytes.
+class PrintServer:
+    def __init__(self, close_after=None):
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.close_after = close_after
+        self.received = []
+        self.finished = 0 # number of connections that were closed
+        self.thread = Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while 1:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            data = bytearray()
+            self.received.append(data)
+            with connection:
+                while 1:
+                    chunk = connection.recv(4096)
+                    if not chunk:
+                        break
+                    data += chunk
+                    if self.close_after and len(self.received) == 1 and len(data) >= self.close_after:
+                        break
+            self.finished += 1
+
+    def stop(self):
+        # wakes up accept()
+        self.server.shutdown(socket.SHUT_RDWR)
+        self.server.close()
+        self.thread.join()
+
+def wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return
+        time.sleep(0.01)
+    raise Exception("Timeout")
+
+def test_pages_are_sent_on_one_connection():
+    server = PrintServer()
+    output = TcpOutput("127.0.0.1", server.port, retry_delay=0)
+    output.write(b"PAGE1\f")
+    output.page_boundary(lambda: b"SETUP")
+    output.write(b"PAGE2\f")
+    output.close()
+    wait_for(lambda: server.finished == 1)
+    assert server.received == [b"PAGE1\fPAGE2\f"]
+    server.stop()
+
+def test_dropped_connection_resends_pages_that_may_not_have_arrived_once():
+    server = PrintServer()
+    output = TcpOutput("127.0.0.1", server.port, retry_delay=0)
+    output.write(b"PAGE1\f")
+    output.page_boundary(lambda: b"SETUP2")
+    output.write(b"PAGE2\f")
+    output.page_boundary(lambda: b"SETUP3")
+    output.write(b"PAGE3")
+    output.flush()
+    # the connection breaks in the middle of the third page
+    output.socket.shutdown(socket.SHUT_RDWR)
+    output.write(b"MORE\f")
+    output.page_boundary(lambda: b"SETUP4")
+    output.close()
+    wait_for(lambda: server.finished == 2)
+    assert server.received[0] == b"PAGE1\fPAGE2\fPAGE3"
+    # the first page was followed by the second on the same connection, so it has arrived
+    # the second page may still have been cut off, it is printed again on a new sheet with its setup
+    assert server.received[1] == b"\r\fSETUP2PAGE2\fPAGE3MORE\f"
+    server.stop()
+
+def test_page_is_sent_again_when_server_closes_right_after_the_page_boundary():
+    server = PrintServer(close_after=len(b"PAGE1\f"))
+    output = TcpOutput("127.0.0.1", server.port, retry_delay=0)
+    output.write(b"PAGE1\f")
+    output.page_boundary(lambda: b"SETUP2")
+    wait_for(lambda: server.finished == 1)
+    output.write(b"PAGE2\f")
+    output.close()
+    wait_for(lambda: server.finished == 2)
+    server.stop()
+    # the end of the first page could have been lost in the buffers of the closed connection
+    assert server.received == [b"PAGE1\f", b"\r\fPAGE1\fPAGE2\f"]
+
+def test_idle_connection_closed_by_server_is_reopened_without_resending():
+    server = PrintServer(close_after=len(b"PAGE1\f"))
+    output = TcpOutput("127.0.0.1", server.port, timeout=0.1, retry_delay=0)
+    output.write(b"PAGE1\f")
+    output.page_boundary(lambda: b"SETUP2")
+    wait_for(lambda: server.finished == 1)
+    time.sleep(0.2)
+    output.write(b"PAGE2\f")
+    output.close()
+    wait_for(lambda: server.finished == 2)
+    server.stop()
+    assert server.received == [b"PAGE1\f", b"PAGE2\f"]
+
+def test_unreachable_server_raises_after_retries():
+    server = PrintServer()
+    server.stop()
+    output = TcpOutput("127.0.0.1", server.port, retries=2, retry_delay=0)
+    output.write(b"PAGE1")
+    with pytest.raises(Exception, match="Cannot send"):
+        output.flush()
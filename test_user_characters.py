@@ -0,0 +1,113 @@
+from io import BytesIO
+
+import pytest
+
+from odt2escp import LayoutCache, PrinterOutput, StreamOutput
+from parse_odt import Paragraph
+from user_characters import UserCharacterCache, glyph_columns
+
+font = ("EpsonRomanProportional", 10.5, None, None, None, None)
+
+# returns the glyphs that the printer prints for data, in order
+# follows the downloads, so a code that was redefined too early prints the wrong glyph
+def printed_glyphs(data):
+    defined = {}
+    result = []
+    i = 0
+    while 1:
+        download = data.find(b"\x1b&\x00", i)
+        reference = data.find(b"\x1b%\x01", i)
+        if reference < 0:
+            return result
+        if 0 <= download < reference:
+            code, columns = data[download + 3], data[download + 6]
+            start = download + 8
+            column_data = data[start:start + 3 * columns]
+            defined[code] = next(c for c in "∞αβπΩ" if glyph_columns(c) == column_data)
+            i = start + 3 * columns
+        else:
+            result.append(defined[data[reference + 3]])
+            i = reference + 4
+
+def test_least_recently_printed_glyph_is_replaced():
+    cache = UserCharacterCache(codes=range(1, 3))
+    euro = cache.reference('€')
+    infinity = cache.reference('∞')
+    cache.printed(euro + infinity)
+    cache.printed(cache.reference('€'))
+    cache.reference('α')
+    assert cache.code_of('∞') is None
+    assert cache.code_of('α') == 2
+    assert cache.downloads == 3
+
+def test_glyph_that_is_not_printed_yet_is_kept():
+    cache = UserCharacterCache(codes=range(1, 3))
+    euro = cache.reference('€')
+    infinity = cache.reference('∞')
+    cache.printed(infinity)
+    cache.reference('α')
+    assert cache.code_of('€') == 1
+    assert cache.code_of('α') == 2
+    with pytest.raises(Exception, match="Too many"):
+        cache.reference('π')
+    cache.printed(euro)
+    cache.reference('π')
+    assert cache.code_of('€') is None
+
+def test_expected_glyph_is_kept():
+    cache = UserCharacterCache(codes=range(1, 3))
+    infinity = cache.reference('∞')
+    alpha = cache.reference('α')
+    cache.printed(infinity + alpha)
+    # replayed data that is not printed yet refers to ∞ again
+    cache.expect(infinity)
+    cache.reference('β')
+    assert cache.code_of('∞') == 1
+    assert cache.code_of('α') is None
+
+def print_runs(runs, codes):
+    stream = BytesIO()
+    printer = PrinterOutput(StreamOutput(stream))
+    printer.user_characters = UserCharacterCache(codes=codes)
+    printer.new_paragraph(Paragraph())
+    printer.print_paragraph(runs)
+    printer.end()
+    return stream.getvalue()
+
+def test_glyphs_cycle_through_two_codes():
+    cycle = "∞αβπΩ"
+    # every run is longer than a line, so no line needs more than two glyphs
+    runs = [(font, c + " " + "lorem ipsum " * 8) for c in cycle * 3]
+    data = print_runs(runs, range(0x21, 0x23))
+    assert printed_glyphs(data) == list(cycle * 3)
+    assert data.count(b"\x1b&\x00") == len(cycle * 3)
+
+def test_glyph_on_unprinted_line_is_not_redefined():
+    # the first glyph is encoded before the line breaks of its run, but printed after them
+    runs = [(font, "lorem ipsum " * 20 + "∞"), (font, " α"), (font, " β")]
+    with pytest.raises(Exception, match="Too many"):
+        print_runs(runs, range(0x21, 0x23))
+    data = print_runs(runs, range(0x21, 0x24))
+    assert printed_glyphs(data) == ['∞', 'α', 'β']
+
+# paragraphs are lists of runs
+def print_paragraphs(paragraphs, codes, layout_cache):
+    stream = BytesIO()
+    printer = PrinterOutput(StreamOutput(stream), layout_cache=layout_cache)
+    printer.user_characters = UserCharacterCache(codes=codes)
+    for texts in paragraphs:
+        printer.new_paragraph(Paragraph())
+        printer.print_paragraph([(font, text) for text in texts])
+    printer.end()
+    return stream.getvalue()
+
+def test_replayed_paragraphs_print_like_laid_out_ones():
+    # with two codes, β evicts a glyph of the repeated paragraph, which then has to be laid out again
+    repeated = ["∞ and α"]
+    long = ["β " + "lorem ipsum " * 8, "∞ and α"]
+    paragraphs = [repeated, repeated, ["β"], repeated, repeated, long, long, repeated]
+    cache = LayoutCache()
+    data = print_paragraphs(paragraphs, range(0x21, 0x23), cache)
+    assert cache.hits > 0
+    assert data == print_paragraphs(paragraphs, range(0x21, 0x23), LayoutCache(0))
+    assert "".join(printed_glyphs(data)) == "".join(c for texts in paragraphs for c in "".join(texts) if c in "∞αβ")
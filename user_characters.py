@@ -0,0 +1,267 @@
+import re
+from collections import OrderedDict
+
+# Bitmaps for characters that are downloaded to the printer's RAM as user-defined characters.
+# This avoids switching character tables for a few rare glyphs.
+# Each glyph has 12 rows of 12 columns. A row is printed as two dot rows of 1/180 inch,
+# a column as one dot followed by one blank column of 1/360 inch (LQ proportional mode).
+glyphs = {
+    '€': """
+............
+....######..
+...#......#.
+..#.........
+#######.....
+..#.........
+#######.....
+..#.........
+...#......#.
+....######..
+............
+............
+""",
+    '∞': """
+............
+............
+............
+............
+.###....###.
+#...#..#...#
+#....##....#
+#...#..#...#
+.###....###.
+............
+............
+............
+""",
+    'α': """
+............
+............
+............
+............
+..####...#..
+.#....#.#...
+#......#....
+#......#....
+.#....#.#...
+..####...##.
+............
+............
+""",
+    'β': """
+............
+...####.....
+..#....#....
+..#....#....
+..#...#.....
+..#####.....
+..#.....#...
+..#......#..
+..#.....#...
+..######....
+..#.........
+..#.........
+""",
+    'λ': """
+............
+..##........
+....#.......
+....#.......
+.....#......
+.....#......
+....#.#.....
+...#...#....
+..#.....#...
+.#.......##.
+............
+............
+""",
+    'π': """
+............
+............
+............
+............
+############
+..#......#..
+..#......#..
+..#......#..
+..#......#..
+..#......##.
+............
+............
+""",
+    'σ': """
+............
+............
+............
+............
+..#########.
+.#....#.....
+#......#....
+#......#....
+.#....#.....
+..####......
+............
+............
+""",
+    'Ω': """
+............
+....####....
+..##....##..
+.#........#.
+#..........#
+#..........#
+#..........#
+.#........#.
+..#......#..
+###......###
+............
+............
+""",
+    'Σ': """
+............
+###########.
+.#........#.
+..#.........
+...#........
+....#.......
+...#........
+..#.........
+.#........#.
+###########.
+............
+............
+""",
+    '→': """
+............
+............
+............
+............
+........#...
+.........#..
+###########.
+.........#..
+........#...
+............
+............
+............
+""",
+    '✓': """
+............
+............
+...........#
+..........#.
+.........#..
+........#...
+#......#....
+.#....#.....
+..#..#......
+...##.......
+............
+............
+""",
+}
+
+glyph_space = 3 # blank columns left and right of a glyph in 1/360 inch
+
+# character codes in the user-defined character set that are used for downloaded glyphs
+user_character_codes = range(0x21, 0x7f)
+
+# returns the width of a downloaded glyph in 1/360 inch
+def glyph_width(char):
+    columns = len(glyphs[char].strip().split('\n')[0])
+    return glyph_space + 2 * columns + glyph_space
+
+# returns the ESC & column data of a glyph, 3 bytes per column with the top dot in the highest bit
+def glyph_columns(char):
+    rows = glyphs[char].strip().split('\n')
+    data = bytearray()
+    for column in range(len(rows[0])):
+        dots = 0
+        for row in rows:
+            bit = 1 if row[column] == '#' else 0
+            dots = (dots << 2) | (bit << 1) | bit # every row is two dots high
+        data += dots.to_bytes(3, 'big')
+        data += bytes(3) # blank column
+    return data
+
+# returns the ESC & command that defines the glyph for the given code
+def download_command(char, code):
+    columns = glyph_columns(char)
+    cmd = bytearray(b"\x1b&\x00")
+    cmd += bytes([code, code, glyph_space, len(columns) // 3, glyph_space])
+    cmd += columns
+    return cmd
+
+# matches the bytes that print a downloaded glyph, see UserCharacterCache.reference
+reference_pattern = re.compile(rb"\x1b%\x01(.)\x1b%\x00", re.S)
+
+# Assigns codes in the user-defined character set to glyphs for one print job.
+# Glyphs are downloaded on first use. When all codes are taken, the glyph that was printed least
+# recently is replaced. Glyphs that are referenced by text that has not been printed yet are kept,
+# that text may end up on a later line than the one being printed when it was encoded.
+class UserCharacterCache:
+    def __init__(self, codes=user_character_codes):
+        self.free_codes = list(codes)
+        self.slots = OrderedDict() # glyph -> code, the least recently printed glyph first
+        self.glyph_of = {} # code -> glyph
+        self.pending = {} # glyph -> number of references that have not been printed yet
+        self.downloads = 0
+        self.hits = 0
+        self.referenced = None # set to a dict to record the code of every referenced glyph
+
+    def code_of(self, char):
+        return self.slots.get(char)
+
+    # counts the glyph references in data as not printed yet, used for data that is replayed
+    def expect(self, data):
+        if b"\x1b%" not in data:
+            return
+        for match in reference_pattern.finditer(data):
+            char = self.glyph_of.get(match.group(1)[0])
+            if char is not None:
+                self.pending[char] = self.pending.get(char, 0) + 1
+
+    # called with every line that is sent to the printer
+    def printed(self, data):
+        if b"\x1b%" not in data:
+            return
+        for match in reference_pattern.finditer(data):
+            char = self.glyph_of.get(match.group(1)[0])
+            if char is None:
+                continue
+            if self.pending.get(char):
+                self.pending[char] -= 1
+            self.slots.move_to_end(char)
+
+    def allocate(self):
+        if self.free_codes:
+            return self.free_codes.pop(0)
+        for char, code in self.slots.items():
+            if not self.pending.get(char):
+                del self.slots[char]
+                del self.glyph_of[code]
+                self.pending.pop(char, None)
+                return code
+        raise Exception("Too many different user-defined characters on one line")
+
+    # returns the bytes that print the glyph, including its download the first time it is used
+    # the glyph counts as pending until the bytes are passed to printed
+    def reference(self, char):
+        cmd = bytearray()
+        code = self.slots.get(char)
+        if code is None:
+            code = self.allocate()
+            cmd += download_command(char, code)
+            self.slots[char] = code
+            self.glyph_of[code] = char
+            self.downloads += 1
+        else:
+            self.hits += 1
+        self.pending[char] = self.pending.get(char, 0) + 1
+        if self.referenced is not None:
+            self.referenced[char] = code
+        cmd += b"\x1b%\x01" # select user-defined character set
+        cmd.append(code)
+        cmd += b"\x1b%\x00" # back to ROM characters
+        return cmd